@@ -0,0 +1,63 @@
+"""
+What, not How -- parse time and memory benchmark
+
+Parses a synthetic model of nested groups, each with processes reading and writing data objects,
+and reports the parse time, the peak memory allocated while parsing and the memory retained by the
+parsed model.
+
+    python benchmarks/parse_memory.py [--groups N] [--processes N] [--refs N] [--validate]
+"""
+
+import argparse
+import gc
+import time
+import tracemalloc
+from typing import List
+
+from what_not_how.dsl_parser import parse_model
+
+
+def synthetic_model(groups: int, processes: int, refs: int) -> List[str]:
+    lines = []
+    for g in range(groups):
+        lines.append(f"group G{g}:\n")
+        for p in range(processes):
+            lines.append(f"    process P{g}_{p}:\n")
+            inputs = ", ".join(f"D{g}_{(p + r) % processes}" for r in range(refs))
+            lines.append(f"        input: {inputs}, Shared?\n")
+            lines.append(f"        output: D{g}_{p}, D{g}_{p}_out+\n")
+            lines.append(f"        notes: step {p} of group {g}\n")
+    return lines
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    arg_parser.add_argument("--groups", type=int, default=100)
+    arg_parser.add_argument("--processes", type=int, default=100)
+    arg_parser.add_argument("--refs", type=int, default=4)
+    arg_parser.add_argument("--validate", action="store_true", help="run the validation pass after parsing")
+    args = arg_parser.parse_args()
+
+    lines = synthetic_model(args.groups, args.processes, args.refs)
+    kwargs = {"validate": True} if args.validate else {}
+
+    gc.collect()
+    start = time.perf_counter()
+    parse_model(lines=lines, reporter=None, **kwargs)
+    elapsed = time.perf_counter() - start
+
+    gc.collect()
+    tracemalloc.start()
+    mdl, errors = parse_model(lines=lines, reporter=None, **kwargs)
+    gc.collect()
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(f"{len(lines)} lines, {len(errors)} errors")
+    print(f"parse time:      {elapsed:8.3f} s")
+    print(f"peak allocated:  {peak / 2**20:8.1f} MiB")
+    print(f"model retained:  {retained / 2**20:8.1f} MiB")
+
+
+if __name__ == "__main__":
+    main()
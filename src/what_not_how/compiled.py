@@ -0,0 +1,355 @@
+"""
+What, not How -- compiled binary models (.whatc)
+
+A compiled model is the parsed and post-processed ModelGroup tree flattened into a few tables of
+fixed-size records: groups, data objects, processes and the edges between processes and data
+objects.  Every reference between records is an integer index, so there are no parent cycles to
+untangle, and every string is an index into a single string table.  The file is laid out as
+
+    header      magic, format version, uid count, and the offset and length of each section
+    sections    one array per table, each starting on an 8-byte boundary
+
+A CompiledModel memory-maps the file and views each section in place as a NumPy array, so opening
+one reads only the header; the pages of a table are read when the table is first used.
+load_compiled() rebuilds the ModelGroup tree from the tables, which is much faster than parsing.
+"""
+
+import mmap
+from pathlib import Path
+from typing import Dict, List, Optional, Union
+
+import numpy as np
+
+from what_not_how.model_data import ModelGroup, Process, DataObject, DataIdentifier, ModelOptions
+
+
+MAGIC = b"WHATCMDL"
+FORMAT_VERSION = 1
+COMPILED_SUFFIX = ".whatc"
+
+# -1 stands for None / no reference in every index field
+OPTIONS_DTYPE = np.dtype([
+    ("tool", "<i4"), ("title", "<i4"), ("fname", "<i4"), ("svg_name", "<i4"),
+    ("recurse", "u1"), ("flatten", "<i4"),
+])
+GROUP_DTYPE = np.dtype([("name", "<i4"), ("parent", "<i4"), ("implements", "<i4"), ("options", "<i4")])
+DATA_DTYPE = np.dtype([
+    ("uid", "<i4"), ("name", "<i4"), ("kind", "<i4"), ("desc", "<i4"), ("group", "<i4"), ("parent", "<i4"),
+    ("notes", "<i4"), ("assumptions", "<i4"), ("fields", "<i4"),
+])
+PROCESS_DTYPE = np.dtype([
+    ("uid", "<i4"), ("name", "<i4"), ("desc", "<i4"), ("group", "<i4"), ("parent", "<i4"),
+    ("implemented_by", "<i4"), ("stackable", "u1"),
+    ("notes", "<i4"), ("pre_conditions", "<i4"), ("post_conditions", "<i4"),
+])
+# an input (is_output == 0) or output of a process, in the order they were declared
+EDGE_DTYPE = np.dtype([
+    ("process", "<i4"), ("is_output", "u1"), ("name", "<i4"), ("data_uid", "<i4"),
+    ("optional", "u1"), ("stackable", "u1"),
+])
+
+# a string is string_data[string_offsets[i]:string_offsets[i + 1]], UTF-8 encoded; a list of
+# strings (notes, conditions, ...) is the string indices list_items[list_offsets[i]:list_offsets[i + 1]]
+SECTION_DTYPES = {
+    "string_offsets": np.dtype("<i8"),
+    "string_data": np.dtype("u1"),
+    "list_offsets": np.dtype("<i8"),
+    "list_items": np.dtype("<i4"),
+    "options": OPTIONS_DTYPE,
+    "groups": GROUP_DTYPE,
+    "data_objects": DATA_DTYPE,
+    "processes": PROCESS_DTYPE,
+    "edges": EDGE_DTYPE,
+}
+SECTIONS = list(SECTION_DTYPES)
+
+# each section's (byte offset, number of records)
+HEADER_DTYPE = np.dtype([
+    ("magic", "S8"), ("version", "<u4"), ("uid_count", "<i4"),
+    ("sections", "<i8", (len(SECTIONS), 2)),
+])
+
+
+class _Tables:
+    """Collects the records of a model while it is flattened"""
+
+    def __init__(self):
+        self.string_index: Dict[str, int] = {}
+        self.strings: List[str] = []
+        self.list_offsets = [0]
+        self.list_items: List[int] = []
+        self.rows: Dict[str, list] = {name: [] for name in ("options", "groups", "data_objects", "processes", "edges")}
+
+    def string(self, s: Optional[str]) -> int:
+        if s is None:
+            return -1
+        index = self.string_index.get(s)
+        if index is None:
+            index = self.string_index[s] = len(self.strings)
+            self.strings.append(s)
+        return index
+
+    def string_list(self, items: List[str]) -> int:
+        self.list_items.extend(self.string(s) for s in items)
+        self.list_offsets.append(len(self.list_items))
+        return len(self.list_offsets) - 2
+
+    def arrays(self) -> Dict[str, np.ndarray]:
+        encoded = [s.encode() for s in self.strings]
+        string_offsets = np.zeros(len(encoded) + 1, dtype=SECTION_DTYPES["string_offsets"])
+        np.cumsum([len(b) for b in encoded], out=string_offsets[1:])
+        arrays = {
+            "string_offsets": string_offsets,
+            "string_data": np.frombuffer(b"".join(encoded), dtype=SECTION_DTYPES["string_data"]),
+            "list_offsets": np.array(self.list_offsets, dtype=SECTION_DTYPES["list_offsets"]),
+            "list_items": np.array(self.list_items, dtype=SECTION_DTYPES["list_items"]),
+        }
+        for name, rows in self.rows.items():
+            arrays[name] = np.array(rows, dtype=SECTION_DTYPES[name])
+        return arrays
+
+
+def _flatten(model: ModelGroup) -> _Tables:
+    tables = _Tables()
+    string, string_list = tables.string, tables.string_list
+
+    # number the groups in pre-order, so a group's parent always comes before it and the
+    # subgroups of each group keep their order
+    groups: List[ModelGroup] = []
+    stack = [model]
+    while stack:
+        group = stack.pop()
+        groups.append(group)
+        stack.extend(reversed(list(group.groups.values())))
+    group_index = {id(group): i for i, group in enumerate(groups)}
+
+    def index_of(group: Optional[ModelGroup]) -> int:
+        return -1 if group is None else group_index.get(id(group), -1)
+
+    for i, group in enumerate(groups):
+        options = -1
+        if group.options is not None:
+            opt = group.options
+            options = len(tables.rows["options"])
+            tables.rows["options"].append((
+                string(opt.tool), string(opt.title), string(opt.fname), string(opt.svg_name),
+                opt.recurse, opt.flatten,
+            ))
+        tables.rows["groups"].append((string(group.name), index_of(group.parent), string(group.implements), options))
+
+        for data_obj in group.data_objects.values():
+            tables.rows["data_objects"].append((
+                data_obj.uid, string(data_obj.name), string(data_obj.kind), string(data_obj.desc),
+                i, index_of(data_obj.parent),
+                string_list(data_obj.notes), string_list(data_obj.assumptions), string_list(data_obj.fields),
+            ))
+
+        for process in group.processes.values():
+            process_index = len(tables.rows["processes"])
+            tables.rows["processes"].append((
+                process.uid, string(process.name), string(process.desc), i, index_of(process.parent),
+                index_of(process.implemented_by), process.stackable,
+                string_list(process.notes), string_list(process.pre_conditions), string_list(process.post_conditions),
+            ))
+            for is_output, data_ids in ((0, process.inputs), (1, process.outputs)):
+                for data_id in data_ids:
+                    tables.rows["edges"].append((
+                        process_index, is_output, string(data_id.name), data_id.identifier_id,
+                        data_id.optional, data_id.stackable,
+                    ))
+    return tables
+
+
+def save_compiled(model: ModelGroup, fname: Union[str, Path]) -> None:
+    """
+    Writes a parsed model to a compiled model file.
+
+    Parameters
+    ----------
+    model : ModelGroup
+        the top-level group of a parsed (and usually post-processed) model
+    fname : str or Path
+        the file to write, conventionally with the .whatc suffix
+    """
+    arrays = _flatten(model).arrays()
+
+    header = np.zeros(1, dtype=HEADER_DTYPE)
+    header["magic"] = MAGIC
+    header["version"] = FORMAT_VERSION
+    header["uid_count"] = model.uid_count
+
+    offset = HEADER_DTYPE.itemsize
+    chunks = []
+    for n, name in enumerate(SECTIONS):
+        padding = -offset % 8
+        data = arrays[name].tobytes()
+        chunks.append(b"\0" * padding + data)
+        offset += padding
+        header["sections"][0, n] = (offset, len(arrays[name]))
+        offset += len(data)
+
+    with open(fname, "wb") as f:
+        f.write(header.tobytes())
+        for chunk in chunks:
+            f.write(chunk)
+
+
+class CompiledModel:
+    """
+    A read-only, memory-mapped view of a compiled model file.  Each table is a NumPy structured
+    array viewing the file in place (see the *_DTYPE definitions for the fields), so only the
+    parts of the file that are used get read.
+
+    Parameters
+    ----------
+    fname : str or Path
+        a file written by save_compiled()
+
+    Raises
+    ------
+    ValueError
+        if the file isn't a compiled model, or was written in a different format version
+    """
+
+    def __init__(self, fname: Union[str, Path]):
+        with open(fname, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self._map) < HEADER_DTYPE.itemsize:
+            raise ValueError(f"'{fname}' is not a compiled model")
+        header = np.frombuffer(self._map, dtype=HEADER_DTYPE, count=1)[0]
+        if header["magic"] != MAGIC:
+            raise ValueError(f"'{fname}' is not a compiled model")
+        if header["version"] != FORMAT_VERSION:
+            raise ValueError(
+                f"'{fname}' is compiled model format {header['version']}; this version reads format {FORMAT_VERSION}"
+            )
+        self.uid_count = int(header["uid_count"])
+        self._sections = {name: tuple(int(v) for v in header["sections"][n]) for n, name in enumerate(SECTIONS)}
+
+    def table(self, name: str) -> np.ndarray:
+        offset, count = self._sections[name]
+        return np.frombuffer(self._map, dtype=SECTION_DTYPES[name], count=count, offset=offset)
+
+    @property
+    def groups(self) -> np.ndarray:
+        return self.table("groups")
+
+    @property
+    def data_objects(self) -> np.ndarray:
+        return self.table("data_objects")
+
+    @property
+    def processes(self) -> np.ndarray:
+        return self.table("processes")
+
+    @property
+    def edges(self) -> np.ndarray:
+        return self.table("edges")
+
+    def string(self, index: int) -> Optional[str]:
+        if index < 0:
+            return None
+        offsets = self.table("string_offsets")
+        start = self._sections["string_data"][0]
+        return self._map[start + int(offsets[index]):start + int(offsets[index + 1])].decode()
+
+    def strings(self) -> List[str]:
+        """All of the strings in the string table, decoded"""
+        start = self._sections["string_data"][0]
+        bounds = (self.table("string_offsets") + start).tolist()
+        data = self._map
+        return [data[bounds[i]:bounds[i + 1]].decode() for i in range(len(bounds) - 1)]
+
+    def string_list(self, index: int) -> List[str]:
+        offsets = self.table("list_offsets")
+        items = self.table("list_items")[offsets[index]:offsets[index + 1]]
+        return [self.string(i) for i in items.tolist()]
+
+    def load(self) -> ModelGroup:
+        """Rebuilds the full ModelGroup tree"""
+        strings = self.strings()
+
+        def s(index: int) -> Optional[str]:
+            return None if index < 0 else strings[index]
+
+        list_offsets = self.table("list_offsets").tolist()
+        list_items = self.table("list_items").tolist()
+
+        def string_list(index: int) -> List[str]:
+            start, end = list_offsets[index], list_offsets[index + 1]
+            return [strings[i] for i in list_items[start:end]] if end > start else []
+
+        options = [
+            ModelOptions.model_construct(
+                tool=s(tool), title=s(title), fname=s(fname), svg_name=s(svg_name),
+                recurse=bool(recurse), flatten=flatten,
+            )
+            for tool, title, fname, svg_name, recurse, flatten in self.table("options").tolist()
+        ]
+
+        groups: List[ModelGroup] = []
+        for name, parent, implements, options_index in self.groups.tolist():
+            group = ModelGroup.model_construct(
+                name=s(name),
+                parent=groups[parent] if parent >= 0 else None,
+                implements=s(implements),
+                options=options[options_index] if options_index >= 0 else None,
+            )
+            if parent >= 0:
+                groups[parent].groups[group.name] = group
+            groups.append(group)
+        if not groups:
+            return ModelGroup.model_construct(name="", uid_count=self.uid_count)
+        groups[0].uid_count = self.uid_count
+
+        for uid, name, kind, desc, group, parent, notes, assumptions, fields in self.data_objects.tolist():
+            data_obj = DataObject.model_construct(
+                uid=uid, name=s(name), kind=s(kind), desc=s(desc),
+                parent=groups[parent] if parent >= 0 else None,
+                notes=string_list(notes), assumptions=string_list(assumptions), fields=string_list(fields),
+            )
+            groups[group].data_objects[data_obj.name] = data_obj
+
+        processes: List[Process] = []
+        for (uid, name, desc, group, parent, implemented_by, stackable,
+             notes, pre_conditions, post_conditions) in self.processes.tolist():
+            process = Process.model_construct(
+                uid=uid, name=s(name), desc=s(desc),
+                parent=groups[parent] if parent >= 0 else None,
+                implemented_by=groups[implemented_by] if implemented_by >= 0 else None,
+                stackable=bool(stackable),
+                notes=string_list(notes),
+                pre_conditions=string_list(pre_conditions),
+                post_conditions=string_list(post_conditions),
+            )
+            groups[group].processes[process.name] = process
+            processes.append(process)
+
+        for process, is_output, name, data_uid, optional, stackable in self.edges.tolist():
+            data_id = DataIdentifier(name=strings[name], identifier_id=data_uid,
+                                     optional=bool(optional), stackable=bool(stackable))
+            if is_output:
+                processes[process].outputs.append(data_id)
+            else:
+                processes[process].inputs.append(data_id)
+
+        return groups[0]
+
+    def close(self) -> None:
+        try:
+            self._map.close()
+        except BufferError:
+            # tables handed out are still viewing the map; it is unmapped once they are released
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def load_compiled(fname: Union[str, Path]) -> ModelGroup:
+    """Reads a compiled model file back into a ModelGroup tree"""
+    with CompiledModel(fname) as compiled:
+        return compiled.load()
@@ -0,0 +1,197 @@
+"""
+What, not How -- the diagram intermediate representation
+
+A Diagram is everything a code-to-diagram tool needs to draw the data flow of a model, worked out
+once: the nodes with their labels and styles, the edges with theirs, the groups drawn as
+clusters, and the rank constraints.  Every emitter (see diagrams.py) formats the same Diagram in
+its own tool's language, so a model drawn for several tools is only walked and ranked once, and
+every tool gets the same node ids and the same styling decisions.
+"""
+
+import dataclasses
+from typing import Dict, List, Optional, Tuple
+
+from what_not_how.model_data import ModelGroup, Process, DataObject, Diagnostic, ModelOptions
+from what_not_how.model_processing import data_flow_index, iter_groups
+from what_not_how.graphs import DiGraph
+
+
+@dataclasses.dataclass(slots=True)
+class DiagramNode:
+    id: str
+    uid: int
+    label: str
+    is_data: bool
+    # drawn as a stack of several: a stackable process, or data referenced as stackable
+    stacked: bool = False
+    # data referenced as optional
+    optional: bool = False
+    # the id of the cluster the node is drawn in, if any
+    cluster: Optional[str] = None
+
+
+@dataclasses.dataclass(slots=True)
+class DiagramEdge:
+    tail: str
+    head: str
+    # the id of the process the edge is an input or output of
+    process: str
+    optional: bool = False
+    stacked: bool = False
+    # closes a cycle, and is left out of the ranking
+    back: bool = False
+
+
+@dataclasses.dataclass(slots=True)
+class DiagramCluster:
+    id: str
+    label: str
+    parent: Optional[str] = None
+
+
+@dataclasses.dataclass(slots=True)
+class Diagram:
+    """
+    The nodes are the data objects (those of the groups around a group drawn on its own last),
+    then the processes; the edges are in process order, each process's inputs then its outputs.
+    first_rank and last_rank are the ids of the nodes to be drawn first and last in the flow: the
+    primary inputs and outputs.
+    """
+    title: str = ""
+    nodes: List[DiagramNode] = dataclasses.field(default_factory=list)
+    edges: List[DiagramEdge] = dataclasses.field(default_factory=list)
+    clusters: List[DiagramCluster] = dataclasses.field(default_factory=list)
+    first_rank: List[str] = dataclasses.field(default_factory=list)
+    last_rank: List[str] = dataclasses.field(default_factory=list)
+    diagnostics: List[Diagnostic] = dataclasses.field(default_factory=list)
+
+
+def get_options(mdl: ModelGroup) -> ModelOptions:
+    m = mdl
+    while m.options is None and m.parent is not None:
+        m = m.parent
+    if m.options is not None:
+        return m.options
+    else:
+        return ModelOptions()
+
+
+def preprocess_graph_nodes(mdl: ModelGroup) -> Tuple[List[Process], List[DataObject]]:
+    """
+    Collects the processes and data objects to place in the generated graph.  This function handles if the
+    graph is to be generated starting at a lower level, or if it will flatten some number of layers
+
+    Parameters
+    ----------
+    mdl: Model Group
+        A collection of processes, data objects, and child model groups.  Together they define a system.
+
+    Returns
+    -------
+    List[Process], List[DataObject]
+        A list of the processes to include in this graph, and a list of data objects to include in this graph
+    """
+    process_list: List[Process] = []
+    data_list: List[DataObject] = []
+
+    max_depth = get_options(mdl).flatten
+    collect_and_recurse(mdl, process_list, data_list, max_depth, 0)
+
+    return process_list, data_list
+
+
+def collect_and_recurse(mdl: ModelGroup,
+                        process_list: List[Process],
+                        data_list: List[DataObject],
+                        max_depth: int = 0,
+                        depth: int = 0) -> None:
+    for o in mdl.data_objects.values():
+        data_list.append(o)
+    for p in mdl.processes.values():
+        process_list.append(p)
+    if depth < max_depth:
+        for g in mdl.groups.values():
+            collect_and_recurse(g, process_list, data_list, max_depth, depth + 1)
+
+
+def node_id(uid: int) -> str:
+    return f"N{uid}"
+
+
+def build_diagram(mdl: ModelGroup, debug: bool = False) -> Diagram:
+    """
+    Builds the diagram of a model: the processes and data objects picked by the model's options
+    (see preprocess_graph_nodes), ranked by DiGraph.
+
+    Parameters
+    ----------
+    mdl : ModelGroup
+        the group to draw
+    debug : bool
+        print the ranks once they've been assigned
+
+    Returns
+    -------
+    Diagram
+    """
+    proc_list, obj_list = preprocess_graph_nodes(mdl)
+    dag = DiGraph(proc_list, obj_list, data_flow_index(mdl) if mdl.parent is None else None)
+    dag.initial_ranking(debug)
+
+    diagram = Diagram(title=get_options(mdl).title)
+    clusters: Dict[int, str] = {}
+
+    def cluster_of(group: Optional[ModelGroup]) -> Optional[str]:
+        if group is None or group is mdl:
+            return None
+        if id(group) not in clusters:
+            parent = cluster_of(group.parent)
+            clusters[id(group)] = f"C{len(diagram.clusters)}"
+            diagram.clusters.append(DiagramCluster(clusters[id(group)], group.name, parent))
+        return clusters[id(group)]
+
+    data_nodes: Dict[int, DiagramNode] = {}
+    for obj in obj_list:
+        node = DiagramNode(node_id(obj.uid), obj.uid, obj.desc or obj.name, True, cluster=cluster_of(obj.parent))
+        data_nodes[obj.uid] = node
+        diagram.nodes.append(node)
+
+    # a group's processes read and write data of the groups around it: those are drawn too,
+    # outside of any cluster
+    process_uids = {proc.uid for proc in proc_list}
+    outside = [uid for uid in dag.node_uids.tolist() if uid not in data_nodes and uid not in process_uids]
+    if outside:
+        root = mdl
+        while root.parent is not None:
+            root = root.parent
+        objects = {obj.uid: obj for group in iter_groups(root) for obj in group.data_objects.values()}
+        for uid in outside:
+            obj = objects[uid]
+            node = DiagramNode(node_id(uid), uid, obj.desc or obj.name, True)
+            data_nodes[uid] = node
+            diagram.nodes.append(node)
+
+    tail_uids = dag.node_uids[dag.tails].tolist()
+    head_uids = dag.node_uids[dag.heads].tolist()
+    edge = 0
+    for proc in proc_list:
+        process_id = node_id(proc.uid)
+        diagram.nodes.append(DiagramNode(
+            process_id, proc.uid, proc.desc or proc.name, False, proc.stackable, cluster=cluster_of(proc.parent)
+        ))
+        for data_id in proc.inputs + proc.outputs:
+            tail, head = tail_uids[edge], head_uids[edge]
+            diagram.edges.append(DiagramEdge(
+                node_id(tail), node_id(head), process_id, data_id.optional, data_id.stackable,
+                (tail, head) in dag.back_edges,
+            ))
+            data_node = data_nodes.get(data_id.identifier_id)
+            if data_node is not None:
+                data_node.stacked |= data_id.stackable
+                data_node.optional |= data_id.optional
+            edge += 1
+
+    diagram.first_rank = [node_id(uid) for uid in dag.primary_inputs()]
+    diagram.last_rank = [node_id(uid) for uid in dag.primary_outputs()]
+    diagram.diagnostics = dag.diagnostics()
+    return diagram
@@ -34,16 +34,91 @@ Or perhaps it's:
         output: DataFlowDiagram_SVG
 """
 
-from model_data import ModelGroup, Process, DataObject, ModelOptions, DataIdentifier
-from what_not_how.graphs import DiGraph
-from typing import List, Tuple
+from what_not_how.model_data import ModelGroup, Diagnostic
+from what_not_how.diagram_ir import (
+    Diagram,
+    build_diagram,
+    get_options,
+    preprocess_graph_nodes,
+    collect_and_recurse,
+)
+from typing import Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional
+
+
+class Emitter(NamedTuple):
+    """
+    A diagram backend: emit(diagram) yields the diagram's source in one tool's language, a few
+    lines at a time, so it can be joined into a string, streamed, or written in one go.
+    """
+    name: str
+    suffix: str
+    emit: Callable[[Diagram], Iterator[str]]
+
+
+# the registered backends, by name
+EMITTERS: Dict[str, Emitter] = {}
+
+
+def register_emitter(name: str, suffix: str):
+    """A decorator registering a generator function emit(diagram) as the backend for a diagram tool"""
+    def register(emit: Callable[[Diagram], Iterator[str]]):
+        EMITTERS[name] = Emitter(name, suffix, emit)
+        return emit
+    return register
+
 
+def get_emitter(name: str) -> Emitter:
+    if name not in EMITTERS:
+        raise ValueError(f"Unknown diagram format '{name}': expected one of {', '.join(sorted(EMITTERS))}")
+    return EMITTERS[name]
 
-def build_data_flow_graph(mdl: ModelGroup, output_basename: str, debug=False) -> None:
-    # build_d2_graph(mdl, output_basename)
 
-    proc_list, obj_list = preprocess_graph_nodes(mdl)
-    build_gv_diagram(proc_list, obj_list, output_basename)
+def diagram_source(diagram: Diagram, fmt: str) -> str:
+    """the diagram's source in the format (the name of a registered emitter), as one string"""
+    return "".join(get_emitter(fmt).emit(diagram))
+
+
+def write_diagrams(diagram: Diagram, base_name: str, formats: Iterable[str], debug=False) -> List[str]:
+    """
+    Writes the diagram in each of the formats (names of registered emitters) to
+    <base_name><suffix>, each with a single write, and returns the names of the files written.
+    With debug, the source is printed as well.
+    """
+    fnames = []
+    for name in formats:
+        emitter = get_emitter(name)
+        source = diagram_source(diagram, name)
+        if debug:
+            print(source, end="")
+        fname = base_name + emitter.suffix
+        with open(fname, "w") as f:
+            f.write(source)
+        fnames.append(fname)
+    return fnames
+
+
+def build_data_flow_graph(mdl: ModelGroup, output_basename: str, debug=False, formats: Iterable[str] = ("gv",)) -> List[Diagnostic]:
+    """
+    Builds the diagram of the model once, and writes it in each of the formats.  Returns the
+    graph's diagnostics, e.g. the cycles found.
+    """
+    diagram = build_diagram(mdl, debug)
+    write_diagrams(diagram, output_basename, formats, debug)
+    return diagram.diagnostics
+
+
+def _clusters_by_id(diagram: Diagram) -> Dict[Optional[str], List[str]]:
+    # the ids of the clusters and nodes directly in each cluster (None: the top level)
+    members: Dict[Optional[str], List[str]] = {}
+    for cluster in diagram.clusters:
+        members.setdefault(cluster.parent, []).append(cluster.id)
+    for node in diagram.nodes:
+        if node.cluster is not None:
+            members.setdefault(node.cluster, []).append(node.id)
+    return members
+
+
+BACK_EDGE_STYLE = " [constraint=false; color=red]"
 
 
 def gv_node_gen(id: str, desc: str, is_data: bool, is_optional: bool, is_stacked: bool):
@@ -56,235 +131,140 @@ def gv_node_gen(id: str, desc: str, is_data: bool, is_optional: bool, is_stacked
     return s
 
 
-def build_gv_diagram(proc_list: List[Process],
-                     obj_list: List[DataObject],
-                     base_name: str):
-    dag = DiGraph(proc_list, obj_list)
-    dag.initial_ranking()
-    dag.print_ranks()
-    min_tier = dag.primary_inputs()
-    max_tier = dag.primary_outputs()
-    with open(f"{base_name}.gv", "w") as f:
-        f.write("digraph G {\n")
-        f.write("  splines=true;\n")
-        for obj in obj_list:
-            uid = f"N{obj.uid}"
-            s = gv_node_gen(uid,
-                            obj.desc,
-                            True,
-                            False,
-                            False)
-            f.write("  " + s + "\n")
-        for proc in proc_list:
-            uid = f"N{proc.uid}"
-            s = gv_node_gen(uid,
-                            proc.desc,
-                            False,
-                            False,
-                            False)
-            f.write("  " + s + "\n")
-            for di in proc.inputs:
-                d_uid = f"N{di.identifier_id}"
-                s = f"{d_uid} -> {uid}"
-                f.write("  " + s + "\n")
-            for di in proc.outputs:
-                d_uid = f"N{di.identifier_id}"
-                s = f"{uid} -> {d_uid}"
-                f.write("  " + s + "\n")
-
-        s = "{rank=min; "
-        s += ", ".join([f"N{k}" for k in min_tier])
-        s += "}"
-        f.write("  " + s + "\n")
-        s = "{rank=max; "
-        s += ", ".join([f"N{k}" for k in max_tier])
-        s += "}"
-        f.write("  " + s + "\n")
-
-        f.write("}\n")
-
-
-def get_options(mdl: ModelGroup) -> ModelOptions:
-    m = mdl
-    while m.options is None and m.parent is not None:
-        m = m.parent
-    if m.options is not None:
-        return m.options
-    else:
-        return ModelOptions()
-
-
-def preprocess_graph_nodes(mdl: ModelGroup) -> Tuple[List[Process], List[DataObject]]:
+@register_emitter("gv", ".gv")
+def emit_gv(diagram: Diagram) -> Iterator[str]:
     """
-    Collects the processes and data objects to place in the generated graph.  This function handles if the
-    graph is to be generated starting at a lower level, or if it will flatten some number of layers
-
-    Parameters
-    ----------
-    mdl: Model Group
-        A collection of processes, data objects, and child model groups.  Together they define a system.
-
-    Returns
-    -------
-    List[Process], List[DataObject]
-        A list of the processes to include in this graph, and a list of data objects to include in this graph
+    Yields the Graphviz source of the diagram.  Edges that close a cycle (back edges) are drawn in
+    red and left out of the ranking.
     """
-    process_list: List[Process] = []
-    data_list: List[DataObject] = []
-
-    max_depth = get_options(mdl).flatten
-    collect_and_recurse(mdl, process_list, data_list, max_depth, 0)
+    edges_of: Dict[str, List[str]] = {}
+    for edge in diagram.edges:
+        s = f"{edge.tail} -> {edge.head}"
+        if edge.back:
+            s += BACK_EDGE_STYLE
+        edges_of.setdefault(edge.process, []).append(s)
+
+    yield "digraph G {\n"
+    yield "  splines=true;\n"
+    for node in diagram.nodes:
+        yield "  " + gv_node_gen(node.id, node.label, node.is_data, node.optional, node.stacked) + "\n"
+        # each process's edges follow it
+        for s in edges_of.get(node.id, []):
+            yield "  " + s + "\n"
+
+    members = _clusters_by_id(diagram)
+    labels = {cluster.id: cluster.label for cluster in diagram.clusters}
+
+    def cluster_lines(cluster_id: str, indent: str) -> Iterator[str]:
+        yield f'{indent}subgraph cluster_{cluster_id} {{\n'
+        yield f'{indent}  label="{labels[cluster_id]}";\n'
+        for member in members.get(cluster_id, []):
+            if member in labels:
+                yield from cluster_lines(member, indent + "  ")
+            else:
+                yield f"{indent}  {member};\n"
+        yield f"{indent}}}\n"
+
+    for cluster_id in members.get(None, []):
+        yield from cluster_lines(cluster_id, "  ")
+
+    yield "  {rank=min; " + ", ".join(diagram.first_rank) + "}\n"
+    yield "  {rank=max; " + ", ".join(diagram.last_rank) + "}\n"
+    yield "}\n"
+
+
+@register_emitter("d2", ".d2")
+def emit_d2(diagram: Diagram) -> Iterator[str]:
+    """Yields the D2 source of the diagram, with each cluster as a container"""
+    # a node in a container is referred to by its path through the containers
+    parents = {cluster.id: cluster.parent for cluster in diagram.clusters}
+
+    def path(cluster_id: Optional[str], id: str) -> str:
+        while cluster_id is not None:
+            id = f"{cluster_id}.{id}"
+            cluster_id = parents[cluster_id]
+        return id
+
+    paths = {node.id: path(node.cluster, node.id) for node in diagram.nodes}
+
+    yield "vars: { \n"
+    yield "  d2-config: { \n"
+    yield "     theme-id: 1\n"
+    yield "  } \n"
+    yield "}\n"
+    for cluster in diagram.clusters:
+        yield f"{path(cluster.parent, cluster.id)}: {cluster.label}\n"
+
+    for node in diagram.nodes:
+        node_path = paths[node.id]
+        yield f"{node_path}: {node.label}\n"
+        if not node.is_data:
+            yield f"{node_path}.shape: Hexagon\n"
+            if node.stacked:
+                yield f"{node_path}.style.multiple: true\n"
+
+    for edge in diagram.edges:
+        s = f"{paths.get(edge.tail, edge.tail)} -> {paths.get(edge.head, edge.head)}"
+        if edge.optional:
+            s += " {style: {stroke-dash: 3}}"
+        yield s + "\n"
+
+    for node in diagram.nodes:
+        if node.is_data and node.stacked:
+            yield f"{paths[node.id]}.style.multiple: true\n"
+    for node in diagram.nodes:
+        if node.is_data and node.optional:
+            yield f"{paths[node.id]}.style.stroke-dash: 3\n"
+
+
+def _mermaid_label(label: str) -> str:
+    return '"' + label.replace('"', "#quot;") + '"'
+
+
+@register_emitter("mermaid", ".mmd")
+def emit_mermaid(diagram: Diagram) -> Iterator[str]:
+    """Yields the Mermaid flowchart source of the diagram, with each cluster as a subgraph"""
+    if diagram.title:
+        yield "---\n"
+        yield f"title: {diagram.title}\n"
+        yield "---\n"
+    yield "graph TB\n"
+    for node in diagram.nodes:
+        if node.is_data:
+            yield f"    {node.id}[{_mermaid_label(node.label)}]\n"
+        else:
+            yield f"    {node.id}{{{{{_mermaid_label(node.label)}}}}}\n"
+
+    members = _clusters_by_id(diagram)
+    labels = {cluster.id: cluster.label for cluster in diagram.clusters}
+
+    def cluster_lines(cluster_id: str, indent: str) -> Iterator[str]:
+        yield f"{indent}subgraph {cluster_id}[{_mermaid_label(labels[cluster_id])}]\n"
+        for member in members.get(cluster_id, []):
+            if member in labels:
+                yield from cluster_lines(member, indent + "    ")
+            else:
+                yield f"{indent}    {member}\n"
+        yield f"{indent}end\n"
 
-    return process_list, data_list
+    for cluster_id in members.get(None, []):
+        yield from cluster_lines(cluster_id, "    ")
 
+    for edge in diagram.edges:
+        arrow = "-.->" if edge.optional else "-->"
+        yield f"    {edge.tail} {arrow} {edge.head}\n"
 
-def collect_and_recurse(mdl: ModelGroup,
-                        process_list: List[Process],
-                        data_list: List[DataObject],
-                        max_depth: int = 0,
-                        depth: int = 0) -> None:
-    for o in mdl.data_objects.values():
-        data_list.append(o)
-    for p in mdl.processes.values():
-        process_list.append(p)
-    if depth < max_depth:
-        for g in mdl.groups.values():
-            collect_and_recurse(g, process_list, data_list, max_depth, depth + 1)
 
+def build_gv_diagram(mdl: ModelGroup, base_name: str, debug=False) -> List[Diagnostic]:
+    """Writes the Graphviz diagram of the model to <base_name>.gv, and returns its diagnostics"""
+    return build_data_flow_graph(mdl, base_name, debug, ("gv",))
 
-def build_d2_graph(mdl: ModelGroup, output_basename:str, debug=False) -> None:
-    """
 
-    Parameters
-    ----------
-    mdl : ModelGroup
-        The top-level data structure for the objects to be encoded into a model
+def build_d2_graph(mdl: ModelGroup, output_basename: str, debug=False) -> List[Diagnostic]:
+    """Writes the D2 diagram of the model to <output_basename>.d2, and returns its diagnostics"""
+    return build_data_flow_graph(mdl, output_basename, debug, ("d2",))
 
-    output_basename : str
-        the filename of the input file with the extension stripped off.
-    Returns
-    -------
-    TBD
-    """
 
-    with open(f"{output_basename}.d2", "w") as f:
-        f.write("vars: { \n")
-        f.write("  d2-config: { \n")
-        f.write("     theme-id: 1\n")
-        f.write("  } \n")
-        f.write("}\n")
-
-        # step one: Extract and print out the identifier and text for each node
-        for d in mdl.data_objects.values():
-            identifier = f"D{d.uid}"
-            if d.desc:
-                label = d.desc
-            else:
-                label = d.name
-            s = identifier + ": " + label
-            f.write(s + "\n")
-            if debug:
-                print(s)
-
-        for p in mdl.processes.values():
-            identifier = f"P{p.uid}"
-            if p.desc:
-                label = p.desc
-            else:
-                label = p.name
-            s = identifier + ": " + label
-            f.write(s + "\n")
-            if debug:
-                print(s)
-            s = f"{identifier}.shape: Hexagon"
-            f.write(s + "\n")
-            if debug:
-                print(s)
-
-            if p.stackable:
-                s = f"{identifier}.style.multiple: true"
-                f.write(s + "\n")
-                if debug:
-                    print(s)
-
-        # step two: Extract and print out the information for each edge
-        stackable_data = set()
-        optional_data = set()
-        for p in mdl.processes.values():
-            process_id = f"P{p.uid}"
-            for a_list, is_input in [(p.inputs, True), (p.outputs, False)]:
-                for di in a_list:
-                    data_id = f"D{di.identifier_id}"
-                    stacked = di.stackable
-                    optional = di.optional
-                    if stacked:
-                        stackable_data.add(data_id)
-                    if optional:
-                        optional_data.add(data_id)
-
-                    if is_input:
-                        s = f"{data_id} -> {process_id}"
-                    else:
-                        s = f"{process_id} -> {data_id}"
-                    if optional:
-                        s += " {style: {stroke-dash: 3}}"
-                    f.write(s + "\n")
-                    if debug:
-                        print(s)
-        for data_id in stackable_data:
-            s = f"{data_id}.style.multiple: true"
-            f.write(s + "\n")
-            if debug:
-                print(s)
-        for data_id in optional_data:
-            s = f"{data_id}.style.stroke-dash: 3"
-            f.write(s + "\n")
-            if debug:
-                print(s)
-
-
-# def build_mermaid_graph(mdl: ModelGroup) -> None:
-#     """
-#
-#     Parameters
-#     ----------
-#     mdl : ModelGroup
-#         The top-level data structure for the objects to be encoded into a model
-#
-#     Returns
-#     -------
-#     Unknown.
-#     - Could be the path to an SVG file generated.
-#     - Could be a call to an external tool to bring up the diagram in a browser
-#     """
-#
-#     with open("output.mmd", "w") as f:
-#         f.write("graph TB\n")
-#
-#         # step one: Extract and print out the identifier and text for each node
-#         for d in mdl.data_objects.values():
-#             identifier = f"D{d.uid}"
-#             label = d.name
-#             s = identifier + "[" + label + "]"
-#             f.write("    " + s + "\n")
-#             print(s)
-#
-#         for p in mdl.processes.values():
-#             identifier = f"P{p.uid}"
-#             label = p.name
-#             s = identifier + "{{" + label + "}}"
-#             f.write("    " + s + "\n")
-#             print(s)
-#
-#         # step two: Extract and print out the information for each edge
-#         for p in mdl.processes.values():
-#             process_id = f"P{p.uid}"
-#             for a_list, is_input in [(p.inputs, True), (p.outputs, False)]:
-#                 for di in a_list:
-#                     data_id = f"D{di.identifier_id}"
-#                     if is_input:
-#                         s = f"{data_id}-->{process_id}"
-#                     else:
-#                         s = f"{process_id}-->{data_id}"
-#                     f.write("    " + s + "\n")
-#                     print(s)
+def build_mermaid_graph(mdl: ModelGroup, output_basename: str, debug=False) -> List[Diagnostic]:
+    """Writes the Mermaid diagram of the model to <output_basename>.mmd, and returns its diagnostics"""
+    return build_data_flow_graph(mdl, output_basename, debug, ("mermaid",))
@@ -0,0 +1,101 @@
+"""
+What, not How -- a size-bounded, least-recently-used cache of files in a directory.
+
+Entries are stored one file per key.  Reading an entry touches its modification time, so the
+modification times order the entries from least to most recently used, and eviction removes the
+oldest ones until the cache fits in its size budget again.
+"""
+
+import os
+import tempfile
+from pathlib import Path
+from typing import Optional, Union
+
+
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+
+class DiskCache:
+    """
+    A directory of cached byte strings, keyed by a hex digest.
+
+    Parameters
+    ----------
+    directory : str or Path
+        where the entries are stored.  It is created on the first write.
+    max_bytes : int
+        the total size the entries may use before the least-recently-used ones are evicted
+    suffix : str
+        the file extension given to the entries
+    """
+
+    def __init__(self, directory: Union[str, Path], max_bytes: int = DEFAULT_MAX_BYTES, suffix: str = ""):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.suffix = suffix
+
+    def path_for(self, key: str) -> Path:
+        return self.directory / f"{key}{self.suffix}"
+
+    def get(self, key: str) -> Optional[bytes]:
+        """Returns the cached bytes for the key (marking them as recently used), or None on a miss."""
+        path = self.path_for(key)
+        try:
+            data = path.read_bytes()
+        except OSError:
+            return None
+        self.touch(path)
+        return data
+
+    def put(self, key: str, data: bytes) -> Path:
+        """Stores the bytes under the key, then evicts old entries if the cache is over its size budget."""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self.path_for(key)
+        # write to a temporary file and rename, so a concurrent reader never sees a partial entry
+        fd, tmp_name = tempfile.mkstemp(dir=self.directory, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_name, path)
+        except BaseException:
+            if os.path.exists(tmp_name):
+                os.remove(tmp_name)
+            raise
+        self.evict()
+        return path
+
+    @staticmethod
+    def touch(path: Path) -> None:
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+    def evict(self) -> None:
+        """Removes the least-recently-used entries until the total size is within max_bytes."""
+        entries = []
+        total = 0
+        for path in self.directory.glob(f"*{self.suffix}"):
+            if path.name.startswith(".tmp-"):
+                continue
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+        if total <= self.max_bytes:
+            return
+        entries.sort()
+        for _mtime, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                path.unlink()
+                total -= size
+            except OSError:
+                pass
+
+    def clear(self) -> None:
+        for path in self.directory.glob(f"*{self.suffix}"):
+            path.unlink(missing_ok=True)
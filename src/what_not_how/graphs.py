@@ -1,113 +1,368 @@
-# import numpy as np
-from what_not_how.model_data import ModelGroup, Process, DataObject, DataIdentifier
+import numpy as np
+from typing import Optional
+from what_not_how.model_data import ModelGroup, Process, DataObject, DataIdentifier, Diagnostic, DataFlowIndex
 
 
 class Node:
-    def __init__(self):
-        self.edges_in = []
-        self.edges_out = []
-        self.rank = None
-        self.flag = False
-        self.name = None
+    """A lightweight view of one node of a DiGraph; the data itself lives in the graph's arrays."""
+
+    __slots__ = ("graph", "index")
+
+    def __init__(self, graph: "DiGraph", index: int):
+        self.graph = graph
+        self.index = index
+
+    @property
+    def uid(self) -> int:
+        return int(self.graph.node_uids[self.index])
+
+    @property
+    def name(self):
+        return self.graph.names[self.index]
+
+    @property
+    def rank(self):
+        rank = int(self.graph.rank[self.index])
+        return rank if rank > 0 else None
+
+    @property
+    def edges_in(self) -> list["Edge"]:
+        return [Edge(self.graph, int(e)) for e in self.graph.edges_into(self.index)]
+
+    @property
+    def edges_out(self) -> list["Edge"]:
+        return [Edge(self.graph, int(e)) for e in self.graph.edges_out_of(self.index)]
 
 
 class Edge:
-    def __init__(self, tail, head):
-        self.tail = tail
-        self.head = head
-        self.flag = False
+    """A lightweight view of one edge of a DiGraph."""
+
+    __slots__ = ("graph", "index")
+
+    def __init__(self, graph: "DiGraph", index: int):
+        self.graph = graph
+        self.index = index
+
+    @property
+    def tail(self) -> Node:
+        return Node(self.graph, int(self.graph.tails[self.index]))
+
+    @property
+    def head(self) -> Node:
+        return Node(self.graph, int(self.graph.heads[self.index]))
+
+    @property
+    def is_back_edge(self) -> bool:
+        return bool(self.graph.is_back[self.index])
+
+
+class _Views:
+    """A read-only sequence of Node or Edge views, created as they're accessed"""
+
+    __slots__ = ("graph", "view", "length")
+
+    def __init__(self, graph: "DiGraph", view, length: int):
+        self.graph = graph
+        self.view = view
+        self.length = length
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, index: int):
+        if index < 0:
+            index += self.length
+        if not 0 <= index < self.length:
+            raise IndexError(index)
+        return self.view(self.graph, index)
+
+    def __iter__(self):
+        for index in range(self.length):
+            yield self.view(self.graph, index)
+
+
+def _gather_ranges(starts: np.ndarray, counts: np.ndarray) -> np.ndarray:
+    """the concatenation of range(start, start + count) for each start and count"""
+    total = int(counts.sum())
+    if total == 0:
+        return np.zeros(0, dtype=np.int64)
+    run_starts = np.cumsum(counts) - counts
+    return np.arange(total, dtype=np.int64) - np.repeat(run_starts - starts, counts)
 
 
 class DiGraph:
-    def __init__(self, proc_list: list[Process], data_list: list[DataObject]):
-        self.nodes = []
-        self.edges = []
-        self.connections = []
-        self.x = []
-        self.build(proc_list, data_list)
-
-    def build(self, proc_list: list[Process], data_list: list[DataObject]):
-        max_pid = max([x.uid for x in proc_list])
-        max_did = max([x.uid for x in data_list])
-        n = max([max_pid, max_did]) + 1
-        for i in range(n):
-            row = [0 for _ in range(n)]
-            self.connections.append(row)
-            self.nodes.append(Node())
-
-        for dat in data_list:
-            self.nodes[dat.uid].name = dat.name
-
-        for proc in proc_list:
-            self.nodes[proc.uid].name = proc.name
-            p_id = proc.uid
-            for d in proc.inputs:
-                d_id = d.identifier_id
-                self.connect(d_id, p_id)
-
-            for d in proc.outputs:
-                d_id = d.identifier_id
-                self.connect(p_id, d_id)
-
-    def connect(self, tail: int, head: int):
-        self.connections[tail][head] = 1
-        edge = Edge(self.nodes[tail], self.nodes[head])
-        self.nodes[tail].edges_out.append(edge)
-        self.nodes[head].edges_in.append(edge)
-        self.edges.append(edge)
+    """
+    The data-flow graph of a list of processes and data objects.  Data objects and processes are
+    both nodes; a process's inputs are edges into it, and its outputs are edges out of it.
+
+    The nodes are numbered 0..n-1 in the order they're added, and index_of maps a model uid to its
+    node number.  Since uids are allocated densely within a model, index_of is a plain array no
+    longer than the model, even if the graph only covers part of it.
+
+    The graph is stored in NumPy arrays: the tail and head node of every edge, the degree and rank of
+    every node, and compressed sparse row (CSR) indexes of the edges out of and into each node.
+    Degrees, primary inputs and outputs, and ranks are computed with vectorized operations over
+    those arrays.  The nodes and edges attributes hand out lightweight views for code that wants
+    objects.
+
+    The edges are added in the order of the process list, each process's inputs then its outputs.
+    Given the model's DataFlowIndex, they are sliced out of its edge arrays rather than gathered
+    from the processes' inputs and outputs.
+    """
+
+    def __init__(self, proc_list: list[Process], data_list: list[DataObject], flow: Optional[DataFlowIndex] = None):
+        self.node_uids = np.zeros(0, dtype=np.int64)
+        self.names: list = []
+        self.index_of = np.zeros(0, dtype=np.int64)
+        self.tails = np.zeros(0, dtype=np.int64)
+        self.heads = np.zeros(0, dtype=np.int64)
+        self.in_degree = np.zeros(0, dtype=np.int64)
+        self.out_degree = np.zeros(0, dtype=np.int64)
+        self.rank = np.zeros(0, dtype=np.int64)
+        self.is_back = np.zeros(0, dtype=bool)
+        self.ranks: list[list[int]] = []
+        self.components: list[list[int]] = []
+        self.back_edges: set[tuple[int, int]] = set()
+        self.build(proc_list, data_list, flow)
+
+    @property
+    def nodes(self) -> _Views:
+        return _Views(self, Node, len(self.names))
+
+    @property
+    def edges(self) -> _Views:
+        return _Views(self, Edge, len(self.tails))
+
+    def build(self, proc_list: list[Process], data_list: list[DataObject], flow: Optional[DataFlowIndex] = None):
+        uids = [x.uid for x in data_list] + [x.uid for x in proc_list]
+        names = [x.name for x in data_list] + [x.name for x in proc_list]
+        if flow is not None:
+            ranges = np.array([flow.edge_ranges[proc.uid] for proc in proc_list], dtype=np.int64).reshape(-1, 2)
+            edges = _gather_ranges(ranges[:, 0], ranges[:, 1])
+            tail_uids = flow.edge_tails[edges]
+            head_uids = flow.edge_heads[edges]
+        else:
+            tails = []
+            heads = []
+            for proc in proc_list:
+                p_id = proc.uid
+                for d in proc.inputs:
+                    tails.append(d.identifier_id)
+                    heads.append(p_id)
+                for d in proc.outputs:
+                    tails.append(p_id)
+                    heads.append(d.identifier_id)
+            tail_uids = np.array(tails, dtype=np.int64)
+            head_uids = np.array(heads, dtype=np.int64)
+
+        edge_uids = np.concatenate((tail_uids, head_uids))
+        max_uid = max(max(uids, default=-1), int(edge_uids.max(initial=-1)))
+        index_of = np.full(max_uid + 1, -1, dtype=np.int64)
+        node_uids = []
+        for uid, name in zip(uids, names):
+            if index_of[uid] < 0:
+                index_of[uid] = len(node_uids)
+                node_uids.append(uid)
+                self.names.append(name)
+        # data objects referenced from outside of the graph's list of data objects, in the order
+        # they're first referenced
+        outside = edge_uids[index_of[edge_uids] < 0]
+        _, first = np.unique(outside, return_index=True)
+        outside = outside[np.sort(first)]
+        index_of[outside] = np.arange(len(node_uids), len(node_uids) + len(outside))
+        node_uids.extend(outside.tolist())
+        self.names.extend([None] * len(outside))
+
+        self.index_of = index_of
+        self.node_uids = np.array(node_uids, dtype=np.int64)
+        self.tails = index_of[tail_uids]
+        self.heads = index_of[head_uids]
+        self._index_edges()
+
+    def _index_edges(self):
+        n = len(self.node_uids)
+        self.out_degree = np.bincount(self.tails, minlength=n)
+        self.in_degree = np.bincount(self.heads, minlength=n)
+        # CSR indexes: the edges out of node i are out_edges[out_offsets[i]:out_offsets[i+1]]
+        self.out_edges = np.argsort(self.tails, kind="stable")
+        self.out_offsets = np.concatenate(([0], np.cumsum(self.out_degree)))
+        self.in_edges = np.argsort(self.heads, kind="stable")
+        self.in_offsets = np.concatenate(([0], np.cumsum(self.in_degree)))
+        self.rank = np.zeros(n, dtype=np.int64)
+        self.is_back = np.zeros(len(self.tails), dtype=bool)
+
+    def edges_out_of(self, i: int) -> np.ndarray:
+        return self.out_edges[self.out_offsets[i]:self.out_offsets[i + 1]]
+
+    def edges_into(self, i: int) -> np.ndarray:
+        return self.in_edges[self.in_offsets[i]:self.in_offsets[i + 1]]
+
+    def successors(self, i: int) -> np.ndarray:
+        """the node numbers at the heads of the edges out of node i"""
+        return self.heads[self.edges_out_of(i)]
+
+    def predecessors(self, i: int) -> np.ndarray:
+        """the node numbers at the tails of the edges into node i"""
+        return self.tails[self.edges_into(i)]
+
+    def is_connected(self, tail_uid: int, head_uid: int) -> bool:
+        """True if there's an edge from the first node to the second"""
+        tail = self.index_of[tail_uid]
+        head = self.index_of[head_uid]
+        if self.out_degree[tail] <= self.in_degree[head]:
+            return bool(np.any(self.successors(tail) == head))
+        return bool(np.any(self.predecessors(head) == tail))
 
     def primary_inputs(self) -> list[int]:
-        input_list = []
-        n = len(self.connections)
-        for i in range(n):
-            is_input = True
-            for j in range(n):
-                if self.connections[j][i] > 0:
-                    is_input = False
-                    break
-            if is_input:
-                input_list.append(i)
-        return input_list
+        """the uids of the nodes without any edges in"""
+        return self.node_uids[self.in_degree == 0].tolist()
 
     def primary_outputs(self) -> list[int]:
-        output_list = []
-        n = len(self.connections)
-        for i in range(n):
-            is_output = True
-            for j in range(n):
-                if self.connections[i][j] > 0:
-                    is_output= False
-                    break
-            if is_output:
-                output_list.append(i)
-        return output_list
-
-    def initial_ranking(self):
-        finished = False
-        iters = 0
-        while not finished:
-            iters += 1
-            finished = True
-            for node in self.nodes:
-                if node.rank is None:
-                    finished = False
-                    done = True
-                    rank = 0
-                    for edge in node.edges_in:
-                        if edge.tail.rank is None:
-                            done = False
+        """the uids of the nodes without any edges out"""
+        return self.node_uids[self.out_degree == 0].tolist()
+
+    def strongly_connected_components(self) -> list[list[int]]:
+        """
+        Finds the strongly-connected components with Tarjan's algorithm, run iteratively so long
+        paths don't hit the recursion limit.  The same depth-first search finds the back edges:
+        edges to a node still on the search path.  Without them the graph is acyclic, and its
+        topological order is the order of the condensation DAG (each component shrunk to a node).
+
+        Returns
+        -------
+        list[list[int]]
+            the node numbers in each component, in reverse topological order of the condensation
+        """
+        n = len(self.node_uids)
+        # the search walks edges one at a time, which is faster over Python lists than NumPy arrays
+        out_edges = self.out_edges.tolist()
+        out_offsets = self.out_offsets.tolist()
+        heads = self.heads.tolist()
+        index = [-1] * n
+        low = [0] * n
+        on_stack = [False] * n
+        on_path = [False] * n
+        stack = []
+        components = []
+        back = []
+        counter = 0
+
+        for root in range(n):
+            if index[root] >= 0:
+                continue
+            index[root] = low[root] = counter
+            counter += 1
+            stack.append(root)
+            on_stack[root] = on_path[root] = True
+            work = [(root, out_offsets[root])]
+            while work:
+                v, next_edge = work[-1]
+                if next_edge < out_offsets[v + 1]:
+                    work[-1] = (v, next_edge + 1)
+                    e = out_edges[next_edge]
+                    w = heads[e]
+                    if index[w] < 0:
+                        index[w] = low[w] = counter
+                        counter += 1
+                        stack.append(w)
+                        on_stack[w] = on_path[w] = True
+                        work.append((w, out_offsets[w]))
+                    else:
+                        if on_path[w]:
+                            back.append(e)
+                        if on_stack[w] and index[w] < low[v]:
+                            low[v] = index[w]
+                    continue
+
+                work.pop()
+                on_path[v] = False
+                if work:
+                    u = work[-1][0]
+                    if low[v] < low[u]:
+                        low[u] = low[v]
+                if low[v] == index[v]:
+                    component = []
+                    while True:
+                        w = stack.pop()
+                        on_stack[w] = False
+                        component.append(w)
+                        if w == v:
                             break
-                        elif edge.tail.rank > rank:
-                            rank = edge.tail.rank
-                    if done:
-                        node.rank = rank + 1
-        print(f"iters: {iters}")
+                    component.sort()
+                    components.append(component)
 
-    def print_ranks(self):
-        max_rank = max([n.rank for n in self.nodes])
-        ranks = [[] for _ in range(max_rank)]
-        for node in self.nodes:
-            ranks[node.rank - 1].append(node.name)
+        self.components = components
+        self.is_back = np.zeros(len(self.tails), dtype=bool)
+        self.is_back[back] = True
+        self.back_edges = set(zip(
+            self.node_uids[self.tails[self.is_back]].tolist(),
+            self.node_uids[self.heads[self.is_back]].tolist(),
+        ))
+        return components
+
+    def cycles(self) -> list[list[int]]:
+        """the uids of the nodes in each cycle (each component with more than one node, or a self-loop)"""
+        cycles = []
+        for component in self.components:
+            if len(component) > 1 or np.any(self.successors(component[0]) == component[0]):
+                cycles.append(self.node_uids[component].tolist())
+        return cycles
+
+    def diagnostics(self) -> list[Diagnostic]:
+        diagnostics = []
+        for cycle in self.cycles():
+            names = ", ".join(str(self.names[self.index_of[uid]]) for uid in cycle)
+            diagnostics.append(Diagnostic("cycle", f"These nodes form a cycle: {names}", cycle))
+        return diagnostics
+
+    def initial_ranking(self, debug: bool = False) -> list[list[int]]:
+        """
+        Ranks the nodes by the longest path to them from a primary input: primary inputs get rank 1,
+        and every other node is ranked one more than its highest-ranked predecessor.  Cycles are
+        broken at their back edges (see strongly_connected_components), so the ranks follow the
+        condensation DAG and every node is ranked.
 
-        for r, layer in enumerate(ranks):
-            print(f"rank: {r+1}: " + ", ".join(layer))
+        This is Kahn's topological sort, a whole rank at a time: the nodes whose predecessors are
+        all ranked form the next rank, and the counts of unranked predecessors are updated for all
+        the edges out of a rank at once.  Each node and edge is handled once.
+
+        Parameters
+        ----------
+        debug : bool
+            print the ranks once they've been assigned
+
+        Returns
+        -------
+        list[list[int]]
+            the uids of the nodes in each rank, starting with rank 1
+        """
+        self.strongly_connected_components()
+        n = len(self.node_uids)
+        forward = ~self.is_back
+        remaining = np.bincount(self.heads[forward], minlength=n)
+        forward_out = self.out_edges[forward[self.out_edges]]
+        forward_degree = np.bincount(self.tails[forward], minlength=n)
+        forward_offsets = np.concatenate(([0], np.cumsum(forward_degree)))
+
+        rank = np.zeros(n, dtype=np.int64)
+        layers: list[list[int]] = []
+        frontier = np.flatnonzero(remaining == 0)
+        while frontier.size:
+            rank[frontier] = len(layers) + 1
+            layers.append(self.node_uids[frontier].tolist())
+            edges = forward_out[_gather_ranges(forward_offsets[frontier], forward_degree[frontier])]
+            heads, counts = np.unique(self.heads[edges], return_counts=True)
+            remaining[heads] -= counts
+            frontier = heads[remaining[heads] == 0]
+        self.rank = rank
+        self.ranks = layers
+
+        if debug:
+            print(f"ranked {n} nodes, {len(self.back_edges)} back edges")
+            self.print_ranks()
+        return layers
+
+    def print_ranks(self):
+        for r, layer in enumerate(self.ranks):
+            names = [str(self.names[self.index_of[uid]]) for uid in layer]
+            print(f"rank: {r+1}: " + ", ".join(names))
@@ -0,0 +1,312 @@
+"""
+What, not How -- incremental re-parsing of an edited model
+
+An IncrementalModel keeps a model file's lines split into its top-level blocks, and the model
+parsed from each block on its own.  When lines are edited, only the blocks containing the edit are
+re-parsed; the model is then re-linked from the blocks, in file order:
+
+- the first block to create a top-level data object owns it, and references to that name from the
+  top level of later blocks become references to it;
+- a data object that a nested group created because it couldn't see the top level of the blocks
+  before it is resolved to the top-level object, if one of those blocks created it;
+- top-level groups and processes whose names are taken by earlier blocks are renamed, with an error.
+
+This gives the model a sequential parse of the whole file would.  Re-linking only touches the
+top-level objects of each block and the references to objects whose owner has changed, so the cost
+of an edit grows with the size of the edit (plus a small amount per top-level block), not with the
+size of the model.  The parallel parser links the blocks parsed by its workers the same way.
+"""
+
+import bisect
+import os
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from what_not_how.dsl_parser import (
+    ParseSession,
+    ErrorData,
+    IncludeCache,
+    top_level_blocks,
+    starts_indented,
+    is_top_level_line,
+    smart_tokenize,
+    dsl,
+)
+from what_not_how.model_data import ModelGroup, DataObject, DataIdentifier, Process, UidAllocator
+from what_not_how.model_processing import iter_groups, renumber_uids
+
+
+def parse_block(
+    lines: Sequence[str],
+    uids: UidAllocator,
+    lexer: str = "classic",
+    base_dir: str = ".",
+    includes: Optional[IncludeCache] = None,
+    include_stack: Tuple[str, ...] = (),
+) -> Tuple[ModelGroup, List[ErrorData]]:
+    """Parses the lines of one top-level block on their own, with line numbers from 0"""
+    session = ParseSession(lexer, base_dir=base_dir, includes=includes, include_stack=include_stack)
+    session.uids = uids
+    fragment = session.parse(lines)
+    return fragment, session.errors
+
+
+def find_header_line(lines: Sequence[str], start: int, end: int, keywords, name: str) -> int:
+    """the line number of the line in lines[start:end] declaring the top-level group or process"""
+    # a top-level declaration is on a top-level line, unless the lines are mis-indented
+    for top_level_only in (True, False):
+        for line_no in range(start, end):
+            line = lines[line_no]
+            if not top_level_only or is_top_level_line(line):
+                tokens = smart_tokenize(line.rstrip("\r\n"), line_no, [])
+                if len(tokens) > 2 and tokens[1] in keywords and tokens[2] == name:
+                    return line_no
+    return start
+
+
+class ParsedBlock:
+    """One top-level block: its line range, the model parsed from it alone, and how it is linked"""
+
+    __slots__ = (
+        "start", "end", "fragment", "errors", "processes", "groups", "root_data", "nested_data",
+        "nested_order", "references", "bound_to", "n_objects",
+    )
+
+    def __init__(self, start: int, end: int, fragment: ModelGroup, errors: List[ErrorData]):
+        self.start = start
+        self.end = end
+        self.fragment = fragment
+        # the errors' line numbers are relative to the start of the block
+        self.errors = errors
+
+        # the top-level objects, with the names they were given in the block
+        self.processes: List[Tuple[str, Process, bool]] = [
+            (name, process, process.desc == name) for name, process in fragment.processes.items()
+        ]
+        self.groups: List[Tuple[str, ModelGroup]] = list(fragment.groups.items())
+        self.root_data: List[Tuple[str, DataObject]] = list(fragment.data_objects.items())
+
+        # the data objects nested groups created for references they couldn't resolve, and the
+        # original order of the data objects of those groups
+        self.nested_data: List[Tuple[ModelGroup, str, DataObject]] = []
+        self.nested_order: Dict[int, Tuple[ModelGroup, List[Tuple[str, DataObject]]]] = {}
+        objects: Dict[int, DataObject] = {}
+        for group in iter_groups(fragment):
+            for name, data_obj in group.data_objects.items():
+                objects[data_obj.uid] = data_obj
+                if group is not fragment and data_obj.kind == "UNDEFINED":
+                    self.nested_data.append((group, name, data_obj))
+                    self.nested_order[id(group)] = (group, list(group.data_objects.items()))
+
+        # the data identifiers referring to each data object that may be linked to another block's
+        linkable = {id(data_obj) for _, data_obj in self.root_data}
+        linkable.update(id(data_obj) for _, _, data_obj in self.nested_data)
+        self.references: Dict[int, List[DataIdentifier]] = {key: [] for key in linkable}
+        self.n_objects = len(objects)
+        for group in iter_groups(fragment):
+            self.n_objects += len(group.processes)
+            for process in group.processes.values():
+                for data_id in process.inputs + process.outputs:
+                    data_obj = objects.get(data_id.identifier_id)
+                    if data_obj is not None and id(data_obj) in linkable:
+                        self.references[id(data_obj)].append(data_id)
+
+        # the object each linkable data object currently stands for: itself, or another block's
+        self.bound_to: Dict[int, DataObject] = {}
+
+    def bind(self, data_obj: DataObject, target: DataObject) -> bool:
+        """Points the references to data_obj at target.  Returns whether anything changed."""
+        if self.bound_to.get(id(data_obj)) is target:
+            return False
+        self.bound_to[id(data_obj)] = target
+        for data_id in self.references[id(data_obj)]:
+            data_id.identifier_id = target.uid
+        return True
+
+    def local_objects(self) -> Iterable[DataObject]:
+        for _, data_obj in self.root_data:
+            yield data_obj
+        for _, _, data_obj in self.nested_data:
+            yield data_obj
+
+
+def _already_defined(lines: Sequence[str], block: ParsedBlock, message: str, keywords, name: str) -> ErrorData:
+    line_no = find_header_line(lines, block.start, block.end, keywords, name)
+    return ErrorData(message, lines[line_no].strip(), line_no, None)
+
+
+def link_blocks(model: ModelGroup, blocks: Sequence[ParsedBlock], lines: Sequence[str]) -> List[ErrorData]:
+    """
+    (Re-)builds the top level of the model from the blocks of the file, in order, and points every
+    reference at the data object it resolves to.  Returns the errors of the blocks, with their line
+    numbers in the file, and the errors found while linking them.
+    """
+    data_objects: Dict[str, DataObject] = {}
+    processes: Dict[str, Process] = {}
+    groups: Dict[str, ModelGroup] = {}
+    included_files: Dict[str, None] = {}
+    model.options = None
+    # the index of the model's data flow is out of date once its blocks change
+    model.data_flow = None
+    errors = []
+
+    for block in blocks:
+        link_errors = []
+
+        # nested groups resolve to the top-level objects of the blocks before this one
+        regrouped = set()
+        for group, name, data_obj in block.nested_data:
+            if block.bind(data_obj, data_objects.get(name, data_obj)):
+                regrouped.add(id(group))
+        for key in regrouped:
+            group, original = block.nested_order[key]
+            group.data_objects = {
+                name: data_obj for name, data_obj in original if block.bound_to[id(data_obj)] is data_obj
+            }
+
+        for name, data_obj in block.root_data:
+            block.bind(data_obj, data_objects.setdefault(name, data_obj))
+            data_obj.parent = model
+
+        for name, group in block.groups:
+            if name in groups:
+                link_errors.append(_already_defined(
+                    lines, block, f"Group '{name}' is already defined in the current namespace.", dsl.group_kw, name
+                ))
+                while name in groups:
+                    name += "'"
+            group.name = name
+            group.parent = model
+            groups[name] = group
+
+        for name, process, default_desc in block.processes:
+            if name in processes:
+                link_errors.append(_already_defined(
+                    lines, block, f"Data object '{name}' is already defined in the current namespace.", dsl.process_kw,
+                    name,
+                ))
+                while name in processes:
+                    name += "'"
+            process.name = name
+            if default_desc:
+                process.desc = name
+            process.parent = model
+            processes[name] = process
+
+        if block.fragment.options is not None:
+            model.options = block.fragment.options
+        included_files.update(dict.fromkeys(block.fragment.included_files))
+
+        # the errors of the block itself come before the linking errors on the same line
+        block_errors = [
+            ErrorData(error.message, error.line, error.line_no + block.start, error.col_no, error.fname)
+            for error in block.errors
+        ]
+        errors.extend(sorted(block_errors + link_errors, key=lambda error: error.line_no))
+
+    model.data_objects = data_objects
+    model.processes = processes
+    model.groups = groups
+    model.included_files = list(included_files)
+    return errors
+
+
+class IncrementalModel:
+    """
+    A parsed model that can be edited a few lines at a time, re-parsing only what the edit touches.
+    The model and errors are the same as parse_model() gives for the edited lines, apart from the
+    uids, which are unique and below model.uid_count but not consecutive.
+
+    Parameters
+    ----------
+    lines : Iterable[str]
+        the lines of the model file
+    lexer : str
+        the name of the lexer engine to use (a key of LEXERS): "classic" or "fast"
+    base_dir : str
+        the directory that included files are relative to
+    includes : Optional[IncludeCache]
+        the cache of included files to use
+    """
+
+    def __init__(
+        self,
+        lines: Iterable[str],
+        lexer: str = "classic",
+        base_dir: str = ".",
+        includes: Optional[IncludeCache] = None,
+    ):
+        self.lines: List[str] = list(lines)
+        self.lexer = lexer
+        self.base_dir = base_dir
+        self.includes = includes if includes is not None else IncludeCache()
+        self.uids = UidAllocator()
+        self.model = ModelGroup.model_construct(name="")
+        self.errors: List[ErrorData] = []
+        self.blocks: List[ParsedBlock] = [self._parse_block(start, end) for start, end in top_level_blocks(self.lines)]
+        self._link()
+
+    @classmethod
+    def from_file(cls, fname: str, lexer: str = "classic", includes: Optional[IncludeCache] = None):
+        with open(fname) as f:
+            lines = f.readlines()
+        return cls(lines, lexer, os.path.dirname(os.path.abspath(fname)), includes)
+
+    def edit(self, start: int, end: int, new_lines: Sequence[str]) -> None:
+        """
+        Replaces lines[start:end] (0-based, end excluded) with new_lines, and brings the model and
+        errors up to date.  An insertion has start == end, a deletion no new lines.
+        """
+        assert 0 <= start <= end <= len(self.lines), "The edit must be within the lines of the model"
+        new_lines = list(new_lines)
+        delta = len(new_lines) - (end - start)
+
+        # the blocks holding the edited lines.  An edit of a block's first line can join the block
+        # to the one before it, so that one is re-parsed as well.
+        first, last = 0, len(self.blocks) - 1
+        if self.blocks:
+            starts = [block.start for block in self.blocks]
+            first = max(bisect.bisect_right(starts, start) - 1, 0)
+            if first > 0 and start == self.blocks[first].start:
+                first -= 1
+            last = max(bisect.bisect_right(starts, max(end - 1, start)) - 1, first)
+            region_start, region_end = self.blocks[first].start, self.blocks[last].end + delta
+        else:
+            region_start, region_end = 0, len(new_lines)
+
+        self.lines[start:end] = new_lines
+        for block in self.blocks[last + 1:]:
+            block.start += delta
+            block.end += delta
+        if first == 0 and starts_indented(self.lines):
+            # the whole file is one block now
+            last, region_end = len(self.blocks) - 1, len(self.lines)
+        region = self.lines[region_start:region_end]
+        new_blocks = [
+            self._parse_block(region_start + block_start, region_start + block_end)
+            for block_start, block_end in top_level_blocks(region)
+        ]
+        self.blocks[first:last + 1] = new_blocks
+        self._link()
+
+    def _parse_block(self, start: int, end: int) -> ParsedBlock:
+        fragment, errors = parse_block(self.lines[start:end], self.uids, self.lexer, self.base_dir, self.includes)
+        return ParsedBlock(start, end, fragment, errors)
+
+    def _link(self) -> None:
+        self.errors = link_blocks(self.model, self.blocks, self.lines)
+        self._compact_uids()
+        self.model.uid_count = self.uids.count
+
+    def _compact_uids(self) -> None:
+        # every re-parse hands out new uids; renumber once the unused ones outnumber the used ones
+        live = sum(block.n_objects for block in self.blocks)
+        if self.uids.count <= 2 * live + 1024:
+            return
+        renumber_uids(self.model)
+        self.uids = UidAllocator(self.model.uid_count)
+        # the objects standing in for another block's aren't part of the model; give them uids
+        # past the model's, in case they stand for themselves again after a later edit
+        for block in self.blocks:
+            for data_obj in block.local_objects():
+                if block.bound_to[id(data_obj)] is not data_obj:
+                    data_obj.uid = self.uids.next()
@@ -0,0 +1,164 @@
+"""
+What, not How -- upstream / downstream lineage queries
+
+Impact analysis asks which outputs are affected if an input changes (everything downstream of it),
+and where a result comes from (everything upstream of it).  Both are reachability in the
+data-flow graph of the whole model, every group flattened into one graph.
+
+The graph is first shrunk to its condensation: each strongly-connected component (a cycle, or a
+single node) becomes one node, since everything in a cycle reaches everything else in it.  A query
+walks the condensation from the component of the node asked about, and the components it reaches
+are kept as a bitset, one bit per component, so asking again costs a lookup and turning the bits
+back into nodes.
+"""
+
+from typing import Dict, List, Optional, Tuple, Union
+
+import numpy as np
+
+from what_not_how.graphs import DiGraph, _gather_ranges
+from what_not_how.model_data import ModelGroup, Process, DataObject
+from what_not_how.model_processing import iter_groups, data_flow_index
+
+
+# the most closures kept per direction; the cache is emptied when it's full
+MAX_CACHED_CLOSURES = 4096
+
+
+def flatten_model(mdl: ModelGroup) -> Tuple[List[Process], List[DataObject]]:
+    """the processes and data objects of the model and all of its groups, in model order"""
+    process_list: List[Process] = []
+    data_list: List[DataObject] = []
+    for group in iter_groups(mdl):
+        data_list.extend(group.data_objects.values())
+        process_list.extend(group.processes.values())
+    return process_list, data_list
+
+
+def qualified_name(obj: Union[Process, DataObject, ModelGroup]) -> str:
+    """the names of the groups enclosing the object, and its own, joined with dots"""
+    names = [obj.name]
+    group = obj.parent
+    while group is not None and group.parent is not None:
+        names.append(group.name)
+        group = group.parent
+    return ".".join(reversed(names))
+
+
+class Lineage:
+    """
+    Answers upstream and downstream queries on a data-flow graph.
+
+    Parameters
+    ----------
+    dag : DiGraph
+        the graph to query; its strongly-connected components are found if they haven't been
+    objects : Optional[Dict[int, Union[Process, DataObject]]]
+        the model object for each uid, to look nodes up by name
+    """
+
+    def __init__(self, dag: DiGraph, objects: Optional[Dict[int, Union[Process, DataObject]]] = None):
+        self.dag = dag
+        self.objects = objects if objects is not None else {}
+        components = dag.components if dag.components else dag.strongly_connected_components()
+        n = len(dag.node_uids)
+        n_components = len(components)
+
+        # the nodes of each component are component_nodes[component_offsets[c]:component_offsets[c+1]]
+        sizes = np.array([len(component) for component in components], dtype=np.int64)
+        self.component_offsets = np.concatenate(([0], np.cumsum(sizes)))
+        self.component_nodes = np.array([node for component in components for node in component], dtype=np.int64)
+        self.component_of = np.zeros(n, dtype=np.int64)
+        self.component_of[self.component_nodes] = np.repeat(np.arange(n_components, dtype=np.int64), sizes)
+
+        # the edges between components, once each, as adjacency lists in both directions
+        tails = self.component_of[dag.tails]
+        heads = self.component_of[dag.heads]
+        between = tails != heads
+        pairs = np.unique(tails[between] * n_components + heads[between])
+        tails, heads = pairs // n_components, pairs % n_components
+        self._successors = self._adjacency(tails, heads, n_components)
+        self._predecessors = self._adjacency(heads, tails, n_components)
+        self._downstream: Dict[int, np.ndarray] = {}
+        self._upstream: Dict[int, np.ndarray] = {}
+        self._names: Optional[Dict[str, List[int]]] = None
+
+    @classmethod
+    def from_model(cls, mdl: ModelGroup) -> "Lineage":
+        """the lineage of the whole model, every group flattened into one graph"""
+        process_list, data_list = flatten_model(mdl)
+        objects: Dict[int, Union[Process, DataObject]] = {obj.uid: obj for obj in data_list}
+        objects.update((proc.uid, proc) for proc in process_list)
+        return cls(DiGraph(process_list, data_list, data_flow_index(mdl)), objects)
+
+    @staticmethod
+    def _adjacency(tails: np.ndarray, heads: np.ndarray, n: int) -> List[List[int]]:
+        # the walks step one component at a time, which is faster over Python lists
+        order = np.argsort(tails, kind="stable")
+        offsets = np.concatenate(([0], np.cumsum(np.bincount(tails, minlength=n)))).tolist()
+        targets = heads[order].tolist()
+        return [targets[offsets[c]:offsets[c + 1]] for c in range(n)]
+
+    def _closure(self, component: int, adjacency: List[List[int]], cache: Dict[int, np.ndarray]) -> np.ndarray:
+        """the bitset of the components reachable from the component, itself included"""
+        bits = cache.get(component)
+        if bits is not None:
+            return bits
+        reached = bytearray(len(adjacency))
+        reached[component] = 1
+        stack = [component]
+        while stack:
+            for c in adjacency[stack.pop()]:
+                if not reached[c]:
+                    reached[c] = 1
+                    stack.append(c)
+        bits = np.packbits(np.frombuffer(reached, dtype=np.uint8))
+        if len(cache) >= MAX_CACHED_CLOSURES:
+            cache.clear()
+        cache[component] = bits
+        return bits
+
+    def _query(self, uid: int, adjacency: List[List[int]], cache: Dict[int, np.ndarray]) -> List[int]:
+        node = self.dag.index_of[uid] if 0 <= uid < len(self.dag.index_of) else -1
+        if node < 0:
+            raise KeyError(f"No node with uid {uid} in the graph")
+        reached = np.unpackbits(self._closure(self.component_of[node], adjacency, cache), count=len(adjacency))
+        # components are numbered in reverse topological order, so walk them backwards
+        components = np.flatnonzero(reached)[::-1]
+        starts = self.component_offsets[components]
+        nodes = self.component_nodes[_gather_ranges(starts, self.component_offsets[components + 1] - starts)]
+        return [u for u in self.dag.node_uids[nodes].tolist() if u != uid]
+
+    def downstream(self, uid: int) -> List[int]:
+        """the uids of the nodes reachable from the node, in topological order"""
+        return self._query(uid, self._successors, self._downstream)
+
+    def upstream(self, uid: int) -> List[int]:
+        """the uids of the nodes the node is reachable from, in topological order"""
+        return self._query(uid, self._predecessors, self._upstream)
+
+    def find(self, name: str) -> int:
+        """
+        The uid of the process or data object with the name: either a qualified name (the names of
+        its enclosing groups and its own, joined with dots) or a name found in a single group.
+
+        Raises
+        ------
+        KeyError
+            if no object, or more than one object, has the name
+        """
+        if self._names is None:
+            self._names = {}
+            qualified: Dict[str, List[int]] = {}
+            for uid, obj in self.objects.items():
+                self._names.setdefault(obj.name, []).append(uid)
+                qualified.setdefault(qualified_name(obj), []).append(uid)
+            # a qualified name wins over the same name found in some group
+            self._names.update(qualified)
+        matches = self._names.get(name, [])
+        if not matches:
+            raise KeyError(f"Nothing named '{name}' in the model")
+        if len(matches) > 1:
+            names = ", ".join(sorted(qualified_name(self.objects[uid]) for uid in matches))
+            raise KeyError(f"'{name}' is ambiguous: it could be any of {names}")
+        return matches[0]
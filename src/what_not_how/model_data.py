@@ -1,19 +1,91 @@
-from typing import Optional, Dict, List
-from pydantic import BaseModel, Field
+import dataclasses
+import threading
+from typing import Optional, Dict, List, Tuple
+import numpy as np
+from pydantic import BaseModel, ConfigDict, TypeAdapter
 
 
-_next_unique_id: int = 0
+class UidAllocator:
+    """Hands out consecutive uids.  Each parse session has its own, so uids aren't shared between parses."""
 
+    def __init__(self, first_uid: int = 0):
+        self._next_uid = first_uid
+        self._lock = threading.Lock()
 
-def get_uid() -> int:
-    global _next_unique_id
-    my_id = _next_unique_id
-    _next_unique_id += 1
-    return my_id
+    def next(self) -> int:
+        with self._lock:
+            uid = self._next_uid
+            self._next_uid += 1
+        return uid
+
+    def reserve(self, n: int) -> int:
+        """Hands out n consecutive uids at once, returning the first"""
+        with self._lock:
+            first_uid = self._next_uid
+            self._next_uid += n
+        return first_uid
+
+    @property
+    def count(self) -> int:
+        """the number of the next uid to be handed out"""
+        return self._next_uid
+
+
+class Diagnostic:
+    """
+    A problem found in a model after it has been parsed -- by the graph engine or a validation
+    pass -- as opposed to the per-line errors found by the parser.
+    """
+
+    def __init__(self, kind: str, message: str, uids: Optional[List[int]] = None, severity: str = "warning"):
+        self.kind = kind
+        self.message = message
+        self.uids = uids if uids is not None else []
+        self.severity = severity
+
+    def __repr__(self):
+        return f"Diagnostic({self.kind!r}, {self.message!r})"
+
+
+def format_diagnostic(diagnostic: Diagnostic) -> str:
+    return f"{diagnostic.severity}: {diagnostic.message}"
+
+
+class DataFlowIndex:
+    """
+    Who produces and who consumes each data object of a model, built once by
+    model_processing.build_data_flow_index() so that graph building, the emitters and the
+    validation passes don't each rescan every process's inputs and outputs.
+
+    producers and consumers map the uid of a data object to the processes that output it and take
+    it as an input, in model order.  The edges of the data-flow graph are also kept flat, in the
+    order DiGraph adds them -- each process's inputs, then its outputs: edge_tails and edge_heads
+    are the uids at either end of each edge, edge_refs the data identifier it comes from, and the
+    edges of a process are edge_tails[start:start + count] for (start, count) = edge_ranges[uid].
+
+    The index describes the model as it was when it was built, and uid_count is the model's
+    uid_count then; a model that is changed afterwards needs a new one.
+    """
+
+    def __init__(self, uid_count: int = 0):
+        self.uid_count = uid_count
+        self.producers: Dict[int, List['Process']] = {}
+        self.consumers: Dict[int, List['Process']] = {}
+        self.edge_tails = np.zeros(0, dtype=np.int64)
+        self.edge_heads = np.zeros(0, dtype=np.int64)
+        self.edge_refs: List['DataIdentifier'] = []
+        self.edge_ranges: Dict[int, Tuple[int, int]] = {}
+
+    def producers_of(self, uid: int) -> List['Process']:
+        """the processes with the data object as an output"""
+        return self.producers.get(uid, [])
+
+    def consumers_of(self, uid: int) -> List['Process']:
+        """the processes with the data object as an input"""
+        return self.consumers.get(uid, [])
 
 
 class ModelGroup (BaseModel):
-    # uid: int = Field(default_factory=get_uid)
     name: str
     processes: Dict[str, 'Process'] = {}
     data_objects: Dict[str, 'DataObject'] = {}
@@ -21,10 +93,33 @@ class ModelGroup (BaseModel):
     parent: Optional['ModelGroup'] = None
     implements: Optional[str] = None
     options: Optional['ModelOptions'] = None
+    # set on a parsed top-level group: its processes and data objects have uids below uid_count
+    # (0..uid_count-1 for a model parsed in one go)
+    uid_count: int = 0
+    # set on a parsed top-level group: the files it includes, directly or not
+    included_files: List[str] = []
+    # set on a top-level group by post-load processing
+    data_flow: Optional[DataFlowIndex] = None
+    diagnostics: List[Diagnostic] = []
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    def new_uid(self) -> int:
+        """
+        A uid for a process or data object added to the model after it was parsed: the uids are
+        per model, so it is the top-level group's uid_count, which is then incremented.
+        """
+        root = self
+        while root.parent is not None:
+            root = root.parent
+        uid = root.uid_count
+        root.uid_count += 1
+        return uid
 
 
 class DataObject (BaseModel):
-    uid: int = Field(default_factory=get_uid)
+    # unique within the model: see ModelGroup.new_uid()
+    uid: int
     name: str
     kind: str
     notes: List[str] = []
@@ -35,7 +130,7 @@ class DataObject (BaseModel):
 
 
 class Process (BaseModel):
-    uid: int = Field(default_factory=get_uid)
+    uid: int
     name: str
     inputs: List['DataIdentifier'] = []
     outputs: List['DataIdentifier'] = []
@@ -48,7 +143,10 @@ class Process (BaseModel):
     implemented_by: Optional[ModelGroup] = None
 
 
-class DataIdentifier (BaseModel):
+@dataclasses.dataclass(slots=True)
+class DataIdentifier:
+    # one of these is made for every input and output reference, so it is a slotted dataclass
+    # rather than a pydantic model; validate_model() checks them along with the rest of the model
     name: str
     identifier_id: int
     optional: bool
@@ -66,3 +164,39 @@ class ModelOptions (BaseModel):
 
 ModelGroup.model_rebuild()
 Process.model_rebuild()
+
+
+_data_identifier_adapter = TypeAdapter(DataIdentifier)
+
+
+def validate_model(model: ModelGroup) -> None:
+    """
+    Validates every group, process, data object and data identifier of a model against its field
+    types.  The parser builds the model with model_construct(), which skips validation, so this is
+    the one validation pass over a parsed model.  Each object is validated on its own -- the objects
+    it refers to are validated where they are defined -- so the cycles through the parent
+    references are never followed.
+
+    Parameters
+    ----------
+    model : ModelGroup
+        the top-level group of the model
+
+    Raises
+    ------
+    pydantic.ValidationError
+        for the first object with a field that doesn't match its declared type
+    """
+    groups = [model]
+    while groups:
+        group = groups.pop()
+        ModelGroup.model_validate(dict(group))
+        if group.options is not None:
+            ModelOptions.model_validate(dict(group.options))
+        for data_obj in group.data_objects.values():
+            DataObject.model_validate(dict(data_obj))
+        for process in group.processes.values():
+            Process.model_validate(dict(process))
+            for data_id in process.inputs + process.outputs:
+                _data_identifier_adapter.validate_python(dataclasses.asdict(data_id))
+        groups.extend(group.groups.values())
@@ -1,32 +1,260 @@
-from typing import List, Dict, Optional
+from typing import Callable, FrozenSet, Iterator, List, Dict, Optional, Tuple
+import numpy as np
 from what_not_how.model_data import (
     Process,
     DataObject,
     ModelGroup,
     DataIdentifier,
+    DataFlowIndex,
+    Diagnostic,
     ModelOptions,
 )
 
 
-def post_load_processing(mdl: ModelGroup) -> None:
-    connect_groups_to_implemented_processes(mdl)
-    # check_processes_with_same_inputs
-    # check_processes_with_same_outputs
-    # check_input_output_counts
+def post_load_processing(mdl: ModelGroup) -> List[Diagnostic]:
+    """
+    Connects the groups implementing processes to them, indexes the data flow, and runs the
+    validation passes.  The diagnostics found are kept on the model, and returned.
+    """
+    diagnostics = connect_groups_to_implemented_processes(mdl)
+    mdl.data_flow = build_data_flow_index(mdl)
+    mdl.diagnostics = diagnostics + check_model(mdl)
+    return mdl.diagnostics
 
 
-def connect_groups_to_implemented_processes(mdl: ModelGroup) -> None:
-    # connect groups implementing a process to the implemented process
-    for group in mdl.groups.values():
+def check_model(mdl: ModelGroup) -> List[Diagnostic]:
+    """Runs every validation pass over the model"""
+    return (
+        check_processes_with_same_inputs(mdl)
+        + check_processes_with_same_outputs(mdl)
+        + check_input_output_counts(mdl)
+    )
+
+
+def _where(group: ModelGroup) -> str:
+    return f" in group '{group.name}'" if group.parent is not None else ""
+
+
+def _same_signatures(mdl: ModelGroup, kind: str, what: str, refs: Callable[[Process], List[DataIdentifier]]) -> List[Diagnostic]:
+    # the processes of a group with the same set of references, found by hashing each process's
+    # set once rather than comparing every pair of processes
+    diagnostics = []
+    for group in iter_groups(mdl):
+        by_signature: Dict[FrozenSet[int], List[Process]] = {}
+        for process in group.processes.values():
+            signature = frozenset(data_id.identifier_id for data_id in refs(process))
+            if signature:
+                by_signature.setdefault(signature, []).append(process)
+        for processes in by_signature.values():
+            if len(processes) > 1:
+                names = ", ".join(process.name for process in processes)
+                data = ", ".join(sorted({data_id.name for data_id in refs(processes[0])}))
+                diagnostics.append(Diagnostic(
+                    kind, f"Processes {names}{_where(group)} have the same {what}: {data}",
+                    [process.uid for process in processes],
+                ))
+    return diagnostics
+
+
+def check_processes_with_same_inputs(mdl: ModelGroup) -> List[Diagnostic]:
+    """Processes of the same group that take exactly the same data objects as inputs"""
+    return _same_signatures(mdl, "same-inputs", "inputs", lambda process: process.inputs)
+
+
+def check_processes_with_same_outputs(mdl: ModelGroup) -> List[Diagnostic]:
+    """Processes of the same group that output exactly the same data objects"""
+    return _same_signatures(mdl, "same-outputs", "outputs", lambda process: process.outputs)
+
+
+def check_input_output_counts(mdl: ModelGroup) -> List[Diagnostic]:
+    """
+    Processes without inputs or without outputs, and data objects that no process takes as an input
+    or outputs.
+    """
+    flow = data_flow_index(mdl)
+    diagnostics = []
+    for group in iter_groups(mdl):
+        for process in group.processes.values():
+            if not process.inputs:
+                diagnostics.append(Diagnostic(
+                    "no-inputs", f"Process '{process.name}'{_where(group)} has no inputs", [process.uid]
+                ))
+            if not process.outputs:
+                diagnostics.append(Diagnostic(
+                    "no-outputs", f"Process '{process.name}'{_where(group)} has no outputs", [process.uid]
+                ))
+        for data_obj in group.data_objects.values():
+            if not flow.producers_of(data_obj.uid) and not flow.consumers_of(data_obj.uid):
+                diagnostics.append(Diagnostic(
+                    "unused-data", f"Data object '{data_obj.name}'{_where(group)} is not used by any process",
+                    [data_obj.uid],
+                ))
+    return diagnostics
+
+
+def _qualified_names(mdl: ModelGroup) -> Iterator[Tuple[ModelGroup, str]]:
+    """Yields each group of the model, parents first, with its qualified name ("" for mdl itself)"""
+    stack = [(mdl, "")]
+    while stack:
+        group, path = stack.pop()
+        yield group, path
+        prefix = path + "." if path else ""
+        stack.extend((child, prefix + name) for name, child in reversed(list(group.groups.items())))
+
+
+def build_process_index(mdl: ModelGroup) -> Dict[str, Process]:
+    """
+    Maps the qualified name of every process in the model -- the names of its enclosing groups and
+    its own, joined with dots, e.g. "Outer.Inner.Process" -- to the process.
+    """
+    index: Dict[str, Process] = {}
+    for group, path in _qualified_names(mdl):
+        prefix = path + "." if path else ""
+        for name, process in group.processes.items():
+            index[prefix + name] = process
+    return index
+
+
+def resolve_process_name(index: Dict[str, Process], name: str, scope: str) -> Optional[Process]:
+    """
+    Resolves a reference to a process made from the group with the qualified name scope.  A name
+    starting with "." is absolute: the qualified name of the process.  Any other name is relative:
+    it is looked up in scope, then in each of the groups enclosing it, out to the top level.
+    """
+    if name.startswith("."):
+        return index.get(name[1:])
+    while True:
+        process = index.get(f"{scope}.{name}" if scope else name)
+        if process is not None or not scope:
+            return process
+        scope = scope.rpartition(".")[0]
+
+
+def connect_groups_to_implemented_processes(mdl: ModelGroup) -> List[Diagnostic]:
+    """
+    Connects each group with an implements: setting to the process it implements, found through a
+    qualified-name index of all the processes of the model (see resolve_process_name()).  The name
+    is resolved from the group's parent, which is where the implemented process usually is.
+
+    Returns
+    -------
+    List[Diagnostic]
+        a diagnostic for each name that doesn't resolve, and for each process implemented twice
+    """
+    index = build_process_index(mdl)
+    diagnostics = []
+    for group, path in _qualified_names(mdl):
         impl_proc = group.implements
-        if impl_proc is not None:
-            if impl_proc in mdl.processes:
-                proc = mdl.processes[impl_proc]
-                if proc.implemented_by is None:
-                    proc.implemented_by = group
-                else:
-                    print("Process already implemented")
-            else:
-                print(f"Implemented process '{impl_proc}' is not defined.")
-        # recurse
-        connect_groups_to_implemented_processes(group)
+        if impl_proc is None or group is mdl:
+            continue
+        scope = path.rpartition(".")[0]
+        proc = resolve_process_name(index, impl_proc, scope)
+        if proc is None:
+            diagnostics.append(Diagnostic(
+                "unresolved-implements",
+                f"Group '{path}' implements process '{impl_proc}', which is not defined.",
+                severity="error",
+            ))
+        elif proc.implemented_by is not None and proc.implemented_by is not group:
+            diagnostics.append(Diagnostic(
+                "already-implemented",
+                f"Group '{path}' implements process '{impl_proc}', which is already implemented.",
+                [proc.uid],
+                severity="error",
+            ))
+        else:
+            proc.implemented_by = group
+    return diagnostics
+
+
+def build_data_flow_index(mdl: ModelGroup) -> DataFlowIndex:
+    """
+    Indexes the producers and consumers of every data object in the model, and the edges of its
+    data-flow graph, in one pass over the processes.
+
+    Parameters
+    ----------
+    mdl : ModelGroup
+        the top-level group of the model
+
+    Returns
+    -------
+    DataFlowIndex
+    """
+    index = DataFlowIndex(mdl.uid_count)
+    tails: List[int] = []
+    heads: List[int] = []
+    refs: List[DataIdentifier] = []
+    for group in iter_groups(mdl):
+        for process in group.processes.values():
+            start = len(refs)
+            for data_id in process.inputs:
+                index.consumers.setdefault(data_id.identifier_id, []).append(process)
+                tails.append(data_id.identifier_id)
+                heads.append(process.uid)
+            for data_id in process.outputs:
+                index.producers.setdefault(data_id.identifier_id, []).append(process)
+                tails.append(process.uid)
+                heads.append(data_id.identifier_id)
+            refs.extend(process.inputs)
+            refs.extend(process.outputs)
+            index.edge_ranges[process.uid] = (start, len(refs) - start)
+    index.edge_tails = np.array(tails, dtype=np.int64)
+    index.edge_heads = np.array(heads, dtype=np.int64)
+    index.edge_refs = refs
+    return index
+
+
+def data_flow_index(mdl: ModelGroup) -> DataFlowIndex:
+    """
+    The model's data-flow index, built (and kept on the model) if post-load processing didn't, or
+    rebuilt if the model's uids have changed since it was built.
+    """
+    if mdl.data_flow is None or mdl.data_flow.uid_count != mdl.uid_count:
+        mdl.data_flow = build_data_flow_index(mdl)
+    return mdl.data_flow
+
+
+def iter_groups(mdl: ModelGroup) -> Iterator[ModelGroup]:
+    """Yields the group and all of its subgroups, parents before children, without recursing"""
+    stack = [mdl]
+    while stack:
+        group = stack.pop()
+        yield group
+        stack.extend(reversed(list(group.groups.values())))
+
+
+def remap_uids(mdl: ModelGroup, new_uid: Callable[[int], int]) -> None:
+    """
+    Gives every process and data object in the model the uid new_uid(uid), and points the
+    data identifiers at the new uids of the data objects they refer to.
+    """
+    for group in iter_groups(mdl):
+        for data_obj in group.data_objects.values():
+            data_obj.uid = new_uid(data_obj.uid)
+        for process in group.processes.values():
+            process.uid = new_uid(process.uid)
+            for data_id in process.inputs:
+                data_id.identifier_id = new_uid(data_id.identifier_id)
+            for data_id in process.outputs:
+                data_id.identifier_id = new_uid(data_id.identifier_id)
+
+
+def renumber_uids(mdl: ModelGroup, aliases: Optional[Dict[int, int]] = None, first_uid: int = 0) -> int:
+    """
+    Renumbers the processes and data objects of a model first_uid..first_uid+n-1, keeping their
+    order, after objects have been merged away or models combined.  Data identifiers referring to a
+    uid in aliases (the uid of an object merged away) are pointed at the object it was merged into.
+    Sets and returns the model's uid_count.
+    """
+    old_uids = []
+    for group in iter_groups(mdl):
+        old_uids.extend(data_obj.uid for data_obj in group.data_objects.values())
+        old_uids.extend(process.uid for process in group.processes.values())
+    new_uids = {old: new for new, old in enumerate(sorted(old_uids), first_uid)}
+    for old, target in (aliases or {}).items():
+        new_uids[old] = new_uids[target]
+    remap_uids(mdl, new_uids.__getitem__)
+    mdl.uid_count = first_uid + len(old_uids)
+    mdl.data_flow = None
+    return mdl.uid_count
@@ -0,0 +1,134 @@
+"""
+What, not How -- parsing large model files in parallel
+
+The top-level blocks of a model file are found by their indentation alone, so the file can be cut
+into runs of whole top-level blocks that are parsed independently in a pool of worker processes.
+Each worker parses every block of its chunk on its own, handing out uids from a range of the
+chunk's, so the uids of different chunks never collide.  The blocks are then linked in file order
+by incremental.link_blocks(), exactly as an IncrementalModel links the blocks it re-parses: later
+references resolve to the top-level data objects of earlier blocks, and repeated top-level groups
+and processes are renamed with the error a sequential parse reports.  The linked model is then
+renumbered, which leaves exactly the uids a sequential parse would give.
+"""
+
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import Callable, List, Optional, Sequence, Tuple
+import os
+
+from what_not_how.dsl_parser import ErrorData, IncludeCache, print_error, top_level_blocks, parse_model
+from what_not_how.incremental import ParsedBlock, link_blocks, parse_block
+from what_not_how.model_data import ModelGroup, UidAllocator
+from what_not_how.model_processing import renumber_uids
+
+
+# files shorter than this are parsed sequentially, and no chunk is made smaller than this
+MIN_CHUNK_LINES = 2000
+# chunks per worker, so that workers finishing early can pick up more of the file
+CHUNKS_PER_WORKER = 4
+# the size of each chunk's range of uids
+CHUNK_UID_STRIDE = 1 << 32
+
+
+def split_into_chunks(lines: Sequence[str], n_chunks: int, min_chunk_lines: int = MIN_CHUNK_LINES) -> List[Tuple[int, int]]:
+    """Groups consecutive top-level blocks into at most about n_chunks (start, end) line ranges"""
+    target = max(min_chunk_lines, len(lines) // max(n_chunks, 1))
+    chunks = []
+    for start, end in top_level_blocks(lines):
+        if chunks and chunks[-1][1] - chunks[-1][0] < target:
+            chunks[-1] = (chunks[-1][0], end)
+        else:
+            chunks.append((start, end))
+    return chunks
+
+
+def _parse_chunk(
+    lines: Sequence[str],
+    first_uid: int,
+    lexer: str,
+    base_dir: str,
+    include_stack: Tuple[str, ...],
+) -> List[Tuple[int, int, ModelGroup, List[ErrorData]]]:
+    """Parses each top-level block of the chunk; the line numbers are relative to the chunk"""
+    uids = UidAllocator(first_uid)
+    includes = IncludeCache()
+    results = []
+    for start, end in top_level_blocks(lines):
+        fragment, errors = parse_block(lines[start:end], uids, lexer, base_dir, includes, include_stack)
+        results.append((start, end, fragment, errors))
+    return results
+
+
+def parse_model_parallel(
+    fname: Optional[str] = None,
+    lines: Optional[Sequence[str]] = None,
+    lexer: str = "classic",
+    reporter: Optional[Callable[[ErrorData], None]] = print_error,
+    max_workers: Optional[int] = None,
+    executor: Optional[Executor] = None,
+    min_chunk_lines: int = MIN_CHUNK_LINES,
+):
+    """
+    parse a functional-process model spec, splitting it on its top-level blocks and parsing the
+    pieces in parallel.  The result is the same as parse_model's: the same model, uids and errors.
+
+    Parameters
+    ----------
+    fname : Optional[str]
+    lines : Optional[Sequence[str]]
+        the lines of the model.  Unlike parse_model, the whole file is held in memory.
+    lexer : str
+        the name of the lexer engine to use (a key of LEXERS): "classic" or "fast"
+    reporter : Optional[Callable[[ErrorData], None]]
+        called with each error found once the parse is finished
+    max_workers : Optional[int]
+        the number of worker processes; the number of CPUs by default
+    executor : Optional[Executor]
+        an executor to parse the chunks in, instead of a new process pool
+    min_chunk_lines : int
+        the smallest piece of the file worth parsing on its own.  A file with fewer lines than
+        this is parsed sequentially.
+
+    Returns
+    -------
+    model_data.Model, List[ErrorData]
+    """
+    assert fname is not None or lines is not None, "Must provide either fname or lines"
+    assert fname is None or lines is None, "Can't provide both fname and lines"
+    base_dir, include_stack = ".", ()
+    if fname:
+        path = os.path.abspath(fname)
+        base_dir, include_stack = os.path.dirname(path), (path,)
+        with open(fname) as f:
+            lines = f.readlines()
+
+    n_workers = max_workers or os.cpu_count() or 1
+    chunks = split_into_chunks(lines, n_workers * CHUNKS_PER_WORKER, min_chunk_lines)
+    if len(chunks) < 2 or (n_workers < 2 and executor is None):
+        if fname:
+            return parse_model(fname, lexer=lexer, reporter=reporter)
+        return parse_model(lines=lines, lexer=lexer, reporter=reporter)
+
+    pool = executor if executor is not None else ProcessPoolExecutor(max_workers=n_workers)
+    try:
+        futures = [
+            pool.submit(_parse_chunk, lines[start:end], n * CHUNK_UID_STRIDE, lexer, base_dir, include_stack)
+            for n, (start, end) in enumerate(chunks)
+        ]
+        results = [future.result() for future in futures]
+    finally:
+        if executor is None:
+            pool.shutdown()
+
+    blocks = [
+        ParsedBlock(chunk_start + start, chunk_start + end, fragment, block_errors)
+        for (chunk_start, _), chunk_results in zip(chunks, results)
+        for start, end, fragment, block_errors in chunk_results
+    ]
+    model = ModelGroup.model_construct(name="")
+    errors = link_blocks(model, blocks, lines)
+    renumber_uids(model)
+
+    if reporter is not None:
+        for error in errors:
+            reporter(error)
+    return model, errors
@@ -0,0 +1,142 @@
+"""
+What, not How -- on-disk cache of parsed models
+
+A parsed and post-processed model is stored, pickled and compressed, under a key made from a hash of
+the model file's path and contents, the cache format and the package version, along with hashes of
+the files it includes.  When nothing has changed, loading the model is a single read instead of a
+full parse.  When only an included file has changed, the model is re-parsed, but the other included
+files come from the cache.  The cache only ever holds models this package wrote into it, so it
+should not be pointed at a directory that others can write to.
+"""
+
+import hashlib
+import os
+import pickle
+import zlib
+from importlib.metadata import version, PackageNotFoundError
+from pathlib import Path
+from typing import Callable, Optional, Tuple, List, Union
+
+from what_not_how.disk_cache import DiskCache, DEFAULT_MAX_BYTES
+from what_not_how.dsl_parser import parse_model, ErrorData, IncludeCache, print_error
+from what_not_how.model_data import ModelGroup
+from what_not_how.model_processing import post_load_processing
+
+
+DEFAULT_CACHE_DIR = ".what_cache"
+
+# the version of what is pickled into the cache: bump it whenever ModelGroup, Process, DataObject,
+# DataIdentifier, DataFlowIndex, Diagnostic or ErrorData change, so that entries written by other
+# code are misses.  The package version alone doesn't tell apart the code of a source checkout.
+CACHE_FORMAT = 5
+
+
+def package_version() -> str:
+    try:
+        return version("what-not-how")
+    except PackageNotFoundError:
+        return "unknown"
+
+
+class ParseCache:
+    """
+    Parsed models, keyed by a hash of the model file path and contents plus the cache format and
+    package version.
+
+    Parameters
+    ----------
+    directory : str or Path
+        where the cached models are stored
+    max_bytes : int
+        the size budget of the cache; the least-recently-used models are evicted beyond it
+    """
+
+    def __init__(self, directory: Union[str, Path] = DEFAULT_CACHE_DIR, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.store = DiskCache(directory, max_bytes, suffix=".model")
+
+    @staticmethod
+    def key_for(fname: str, lexer: str = "classic", purpose: str = "model") -> str:
+        """
+        The key of a model file.  purpose tells apart the post-processed models of load_model()
+        from the raw models of included files.  The file's absolute path is part of the key, as
+        its includes are found relative to its directory: the same text elsewhere is another model.
+        """
+        digest = hashlib.sha256()
+        digest.update(f"{CACHE_FORMAT}\0{package_version()}\0{lexer}\0{purpose}\0{os.path.abspath(fname)}\0".encode())
+        with open(fname, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    @staticmethod
+    def file_digest(fname: str) -> Optional[str]:
+        try:
+            with open(fname, "rb") as f:
+                return hashlib.sha256(f.read()).hexdigest()
+        except OSError:
+            return None
+
+    def get(self, key: str) -> Optional[Tuple[ModelGroup, List[ErrorData]]]:
+        """The cached model and errors, or None on a miss or if any of its included files has changed"""
+        data = self.store.get(key)
+        if data is None:
+            return None
+        try:
+            mdl, errors, included = pickle.loads(zlib.decompress(data))
+        except Exception:
+            # a corrupt or incompatible entry is just a miss
+            return None
+        for fname, digest in included.items():
+            if self.file_digest(fname) != digest:
+                return None
+        return mdl, errors
+
+    def put(self, key: str, mdl: ModelGroup, errors: List[ErrorData]) -> None:
+        included = {fname: self.file_digest(fname) for fname in mdl.included_files}
+        data = zlib.compress(pickle.dumps((mdl, list(errors), included), protocol=pickle.HIGHEST_PROTOCOL))
+        self.store.put(key, data)
+
+
+def load_model(
+    fname: str,
+    cache: Optional[ParseCache] = None,
+    lexer: str = "classic",
+    reporter: Optional[Callable[[ErrorData], None]] = print_error,
+) -> Tuple[ModelGroup, List[ErrorData]]:
+    """
+    Parses and post-processes a model file, using the cached result when the file hasn't changed.
+
+    Parameters
+    ----------
+    fname : str
+        the model file
+    cache : Optional[ParseCache]
+        the cache to use, or None to always parse
+    lexer : str
+        the lexer engine passed to parse_model
+    reporter : Optional[Callable[[ErrorData], None]]
+        called with each error of the model, whether it was parsed or came from the cache
+
+    Returns
+    -------
+    ModelGroup, List[ErrorData]
+        the post-processed model, and the errors found while parsing it
+    """
+    hit = None
+    if cache is not None:
+        key = ParseCache.key_for(fname, lexer)
+        hit = cache.get(key)
+
+    if hit is not None:
+        mdl, errors = hit
+    else:
+        includes = IncludeCache(store=cache) if cache is not None else None
+        mdl, errors = parse_model(fname, lexer=lexer, reporter=None, includes=includes)
+        post_load_processing(mdl)
+        if cache is not None:
+            cache.put(key, mdl, errors)
+
+    if reporter is not None:
+        for error in errors:
+            reporter(error)
+    return mdl, errors
@@ -0,0 +1,212 @@
+"""
+What, not How -- rendering diagrams to images in memory
+
+The diagram source is piped into the renderer's standard input and the image is read back from
+its standard output, so nothing is written to disk: a diagram can be rendered from a read-only
+checkout, or served without temporary files.  Writing the source or the image to a file is left
+to the caller.
+
+Each renderer is registered with the emitter that produces its source (see diagrams.EMITTERS)
+and the command line that reads source from stdin and writes an image of a given format to stdout.
+
+Layout is CPU-bound work done in the renderer's own process, so many diagrams -- e.g. one for
+each group of a large model -- render in parallel: render_all() runs them with asyncio
+subprocesses, at most one per CPU at a time, and render_many() is its blocking wrapper.
+"""
+
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional
+import asyncio
+import os
+import subprocess
+
+from what_not_how.diagram_ir import Diagram
+from what_not_how.diagrams import diagram_source
+
+
+class Renderer(NamedTuple):
+    """
+    A diagram tool: the format of the source it reads, its command line for an image format, and
+    the command line printing its version
+    """
+    name: str
+    source_format: str
+    command: Callable[[str], List[str]]
+    version_command: Optional[List[str]] = None
+
+
+# the registered renderers, by name
+RENDERERS: Dict[str, Renderer] = {}
+
+
+def register_renderer(
+    name: str,
+    source_format: str,
+    command: Callable[[str], List[str]],
+    version_command: Optional[List[str]] = None,
+) -> None:
+    RENDERERS[name] = Renderer(name, source_format, command, version_command)
+
+
+register_renderer("dot", "gv", lambda fmt: ["dot", f"-T{fmt}"], ["dot", "-V"])
+register_renderer("d2", "d2", lambda fmt: ["d2", f"--stdout-format={fmt}", "-", "-"], ["d2", "--version"])
+register_renderer(
+    "mermaid", "mermaid", lambda fmt: ["mmdc", "--input", "-", "--output", "-", "--outputFormat", fmt], ["mmdc", "--version"]
+)
+
+
+# the versions of the renderers, looked up once per process
+_versions: Dict[tuple, str] = {}
+
+
+def renderer_version(tool: str) -> str:
+    """The version the renderer reports, or "unknown" if it can't be run"""
+    command = get_renderer(tool).version_command
+    if command is None:
+        return "unknown"
+    key = tuple(command)
+    if key not in _versions:
+        try:
+            result = subprocess.run(command, capture_output=True, timeout=30)
+            # dot -V prints its version to stderr
+            _versions[key] = (result.stdout + result.stderr).decode(errors="replace").strip() or "unknown"
+        except (OSError, subprocess.TimeoutExpired):
+            _versions[key] = "unknown"
+    return _versions[key]
+
+
+class RenderError(Exception):
+    """The renderer couldn't be run, or failed"""
+
+    def __init__(self, message: str, returncode: Optional[int] = None, stderr: str = ""):
+        super().__init__(message)
+        self.returncode = returncode
+        self.stderr = stderr
+
+
+def get_renderer(tool: str) -> Renderer:
+    if tool not in RENDERERS:
+        raise ValueError(f"Unknown renderer '{tool}': expected one of {', '.join(sorted(RENDERERS))}")
+    return RENDERERS[tool]
+
+
+def render_image(source: str, tool: str = "dot", fmt: str = "png", timeout: Optional[float] = None) -> bytes:
+    """
+    Renders diagram source with a diagram tool, through its stdin and stdout.
+
+    Parameters
+    ----------
+    source : str
+        the diagram source, in the language of the tool
+    tool : str
+        the name of the renderer (a key of RENDERERS): "dot", "d2" or "mermaid"
+    fmt : str
+        the image format, e.g. "png" or "svg"
+    timeout : Optional[float]
+        the most seconds to wait for the renderer
+
+    Returns
+    -------
+    bytes
+        the image
+
+    Raises
+    ------
+    RenderError
+        if the renderer isn't installed, times out, or exits with an error
+    """
+    command = get_renderer(tool).command(fmt)
+    try:
+        result = subprocess.run(command, input=source.encode(), capture_output=True, timeout=timeout)
+    except FileNotFoundError:
+        raise RenderError(f"Could not run '{command[0]}': is {tool} installed?")
+    except subprocess.TimeoutExpired:
+        raise RenderError(f"{tool} took longer than {timeout} seconds")
+    stderr = result.stderr.decode(errors="replace")
+    if result.returncode != 0:
+        raise RenderError(f"{tool} failed with exit status {result.returncode}: {stderr.strip()}", result.returncode, stderr)
+    return result.stdout
+
+
+def render_diagram(diagram: Diagram, tool: str = "dot", fmt: str = "png", timeout: Optional[float] = None) -> bytes:
+    """Renders a diagram to an image in memory, emitting the source the tool reads"""
+    source = diagram_source(diagram, get_renderer(tool).source_format)
+    return render_image(source, tool, fmt, timeout)
+
+
+class RenderJob(NamedTuple):
+    """A diagram to render: its source, the tool and image format, and a name to report it by"""
+    source: str
+    tool: str = "dot"
+    fmt: str = "png"
+    name: str = ""
+
+
+class RenderResult(NamedTuple):
+    """The outcome of a RenderJob: the image, or the exit status (None if it never ran) and stderr"""
+    job: RenderJob
+    image: Optional[bytes]
+    returncode: Optional[int]
+    stderr: str
+
+    @property
+    def ok(self) -> bool:
+        return self.image is not None
+
+
+async def render_image_async(job: RenderJob, timeout: Optional[float] = None) -> RenderResult:
+    """Renders one diagram in a subprocess without blocking the event loop.  Never raises RenderError."""
+    command = get_renderer(job.tool).command(job.fmt)
+    try:
+        process = await asyncio.create_subprocess_exec(
+            *command, stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE,
+        )
+    except FileNotFoundError:
+        return RenderResult(job, None, None, f"Could not run '{command[0]}': is {job.tool} installed?")
+    try:
+        stdout, stderr = await asyncio.wait_for(process.communicate(job.source.encode()), timeout)
+    except asyncio.TimeoutError:
+        process.kill()
+        await process.wait()
+        return RenderResult(job, None, None, f"{job.tool} took longer than {timeout} seconds")
+    image = stdout if process.returncode == 0 else None
+    return RenderResult(job, image, process.returncode, stderr.decode(errors="replace"))
+
+
+async def render_all(
+    jobs: Iterable[RenderJob],
+    max_concurrency: Optional[int] = None,
+    timeout: Optional[float] = None,
+) -> List[RenderResult]:
+    """
+    Renders the diagrams concurrently, running at most max_concurrency renderers at a time.
+
+    Parameters
+    ----------
+    jobs : Iterable[RenderJob]
+        the diagrams to render
+    max_concurrency : Optional[int]
+        the most renderers running at once; the number of CPUs by default
+    timeout : Optional[float]
+        the most seconds to wait for each renderer
+
+    Returns
+    -------
+    List[RenderResult]
+        the result of each job, in the order of the jobs.  A failed render doesn't stop the others.
+    """
+    semaphore = asyncio.Semaphore(max_concurrency or os.cpu_count() or 1)
+
+    async def run(job: RenderJob) -> RenderResult:
+        async with semaphore:
+            return await render_image_async(job, timeout)
+
+    return list(await asyncio.gather(*(run(job) for job in jobs)))
+
+
+def render_many(
+    jobs: Iterable[RenderJob],
+    max_concurrency: Optional[int] = None,
+    timeout: Optional[float] = None,
+) -> List[RenderResult]:
+    """The blocking version of render_all(), for code that isn't running an event loop"""
+    return asyncio.run(render_all(jobs, max_concurrency, timeout))
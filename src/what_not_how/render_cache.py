@@ -0,0 +1,105 @@
+"""
+What, not How -- on-disk cache of rendered diagrams
+
+Layout is by far the slowest step of drawing a large diagram, and re-drawing an unchanged model
+gives byte-for-byte the same diagram source (the emitters write nodes, edges and styles in model
+order).  Rendered images are therefore cached under a hash of everything that determines them:
+the source, the renderer's name, command line and version, and the image format.  On a hit the
+cached image is copied into place and the renderer isn't run at all.
+
+The cache is a DiskCache, so it is bounded in size and evicts the least-recently-used images.
+"""
+
+import asyncio
+import hashlib
+import os
+import shutil
+from pathlib import Path
+from typing import Iterable, List, Optional, Union
+
+from what_not_how.disk_cache import DiskCache, DEFAULT_MAX_BYTES
+from what_not_how.parse_cache import DEFAULT_CACHE_DIR
+from what_not_how.render import RenderJob, RenderResult, get_renderer, renderer_version, render_all
+
+
+DEFAULT_RENDER_CACHE_DIR = os.path.join(DEFAULT_CACHE_DIR, "renders")
+
+
+class RenderCache:
+    """
+    Rendered images, keyed by a hash of the diagram source, renderer and image format.
+
+    Parameters
+    ----------
+    directory : str or Path
+        where the cached images are stored
+    max_bytes : int
+        the size budget of the cache; the least-recently-used images are evicted beyond it
+    """
+
+    def __init__(self, directory: Union[str, Path] = DEFAULT_RENDER_CACHE_DIR, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.store = DiskCache(directory, max_bytes, suffix=".image")
+
+    @staticmethod
+    def key_for(job: RenderJob) -> str:
+        digest = hashlib.sha256()
+        command = " ".join(get_renderer(job.tool).command(job.fmt))
+        digest.update(f"{job.tool}\0{command}\0{renderer_version(job.tool)}\0{job.fmt}\0".encode())
+        digest.update(job.source.encode())
+        return digest.hexdigest()
+
+    def get(self, job: RenderJob) -> Optional[bytes]:
+        """The cached image of the job, or None on a miss"""
+        return self.store.get(self.key_for(job))
+
+    def put(self, job: RenderJob, image: bytes) -> None:
+        self.store.put(self.key_for(job), image)
+
+    def copy_to(self, job: RenderJob, fname: Union[str, Path]) -> bool:
+        """Copies the cached image of the job to fname.  Returns False, copying nothing, on a miss."""
+        path = self.store.path_for(self.key_for(job))
+        try:
+            shutil.copyfile(path, fname)
+        except FileNotFoundError:
+            return False
+        self.store.touch(path)
+        return True
+
+
+async def render_all_cached(
+    jobs: Iterable[RenderJob],
+    cache: RenderCache,
+    max_concurrency: Optional[int] = None,
+    timeout: Optional[float] = None,
+) -> List[RenderResult]:
+    """
+    render_all(), with the images taken from the cache where it has them.  Only the other jobs are
+    rendered, and the images rendered successfully are added to the cache.  The cache's disk reads
+    and writes, and the first look-up of each renderer's version, run in threads, so that they
+    don't hold up the other coroutines on the event loop.
+    """
+    jobs = list(jobs)
+    # key_for() runs the renderer to get its version the first time; do that once per tool up front
+    await asyncio.gather(*(asyncio.to_thread(renderer_version, tool) for tool in {job.tool for job in jobs}))
+    images = await asyncio.gather(*(asyncio.to_thread(cache.get, job) for job in jobs))
+    results: List[Optional[RenderResult]] = [
+        RenderResult(job, image, 0, "") if image is not None else None for job, image in zip(jobs, images)
+    ]
+    misses = [i for i, image in enumerate(images) if image is None]
+    rendered = await render_all([jobs[i] for i in misses], max_concurrency, timeout)
+    await asyncio.gather(*(
+        asyncio.to_thread(cache.put, result.job, result.image) for result in rendered if result.ok
+    ))
+    for i, result in zip(misses, rendered):
+        results[i] = result
+    return results
+
+
+def render_many_cached(
+    jobs: Iterable[RenderJob],
+    cache: RenderCache,
+    max_concurrency: Optional[int] = None,
+    timeout: Optional[float] = None,
+) -> List[RenderResult]:
+    """The blocking version of render_all_cached()"""
+    return asyncio.run(render_all_cached(jobs, cache, max_concurrency, timeout))
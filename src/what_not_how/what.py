@@ -1,28 +1,180 @@
-from what_not_how.dsl_parser import parse_model
-from what_not_how.diagrams import build_data_flow_graph
-from what_not_how.model_processing import post_load_processing
-import subprocess
+from what_not_how.compiled import save_compiled, load_compiled, COMPILED_SUFFIX
+from what_not_how.diagram_ir import build_diagram
+from what_not_how.diagrams import diagram_source, write_diagrams
+from what_not_how.lineage import Lineage, qualified_name
+from what_not_how.model_data import ModelGroup, Process, format_diagnostic
+from what_not_how.model_processing import check_model, iter_groups
+from what_not_how.disk_cache import DEFAULT_MAX_BYTES
+from what_not_how.parse_cache import ParseCache, load_model, DEFAULT_CACHE_DIR
+from what_not_how.render import RenderJob, RenderError, render_many
+from what_not_how.render_cache import RenderCache
+from typing import List, Optional
+import argparse
+import os
 import sys
 
 
-def generate_graph(fname: str):
-    mdl, err_list = parse_model(fname)
-    post_load_processing(mdl)
+def load_any_model(fname: str, cache: Optional[ParseCache] = None) -> ModelGroup:
+    if fname.endswith(COMPILED_SUFFIX):
+        mdl = load_compiled(fname)
+        mdl.diagnostics = check_model(mdl)
+        return mdl
+    mdl, err_list = load_model(fname, cache)
+    return mdl
+
+
+def generate_graph(fname: str, cache: Optional[ParseCache] = None, fmt: str = "png", write_source: bool = True,
+                   output: Optional[str] = None, groups: bool = False,
+                   render_cache: Optional[RenderCache] = None) -> List[str]:
+    """
+    Draws the model with Graphviz.  The source is piped to dot, and only the image is written,
+    to output (the model file with the format's suffix by default); the source is written to
+    <basename>.gv as well with write_source.  With groups, each group with processes is drawn too,
+    to <basename>_<group>.<fmt>, and all the diagrams are rendered concurrently.  Diagrams whose
+    image is in the render cache are copied from it instead of being rendered.
+
+    Returns the names of the image files written.  Raises RenderError, once the diagrams that
+    could be rendered have been written, if any couldn't.
+    """
+    mdl = load_any_model(fname, cache)
     output_basename = fname[:(fname.rfind('.'))]
-    build_data_flow_graph(mdl, output_basename)
-    # subprocess.run(['d2', f"{output_basename}.d2", f"{output_basename}.png"])
-    subprocess.run(['dot', f"{output_basename}.gv", "-Tpng", "-o", f"{output_basename}.png"])
+    diagram = build_diagram(mdl)
+    for diagnostic in mdl.diagnostics + diagram.diagnostics:
+        print(format_diagnostic(diagnostic))
+    if write_source:
+        write_diagrams(diagram, output_basename, ["gv"])
+
+    diagrams = [(output if output is not None else f"{output_basename}.{fmt}", diagram)]
+    if groups:
+        for group in iter_groups(mdl):
+            if group is not mdl and group.processes:
+                name = qualified_name(group).replace(".", "_")
+                diagrams.append((f"{output_basename}_{name}.{fmt}", build_diagram(group)))
+    jobs = [
+        RenderJob(diagram_source(diagram, "gv"), "dot", fmt, image_fname) for image_fname, diagram in diagrams
+    ]
+
+    pending = [job for job in jobs if render_cache is None or not render_cache.copy_to(job, job.name)]
+    failed = []
+    for result in render_many(pending):
+        if result.ok:
+            with open(result.job.name, "wb") as f:
+                f.write(result.image)
+            if render_cache is not None:
+                render_cache.put(result.job, result.image)
+        else:
+            failed.append(f"{result.job.name}: {result.stderr.strip()}")
+    if failed:
+        raise RenderError(f"{len(failed)} of {len(jobs)} diagrams couldn't be rendered:\n" + "\n".join(failed))
+    return [job.name for job in jobs]
+
+
+def compile_model(fname: str, out_fname: Optional[str] = None, cache: Optional[ParseCache] = None) -> str:
+    mdl, err_list = load_model(fname, cache)
+    if out_fname is None:
+        out_fname = fname[:(fname.rfind('.'))] + COMPILED_SUFFIX
+    save_compiled(mdl, out_fname)
+    return out_fname
+
+
+def query_model(fname: str, upstream: Optional[str] = None, downstream: Optional[str] = None,
+                cache: Optional[ParseCache] = None) -> List[str]:
+    """
+    The processes and data objects upstream or downstream of the named one, in data-flow order,
+    as lines of "process <qualified name>" or "data <qualified name>".
+    """
+    lineage = Lineage.from_model(load_any_model(fname, cache))
+    if upstream is not None:
+        uids = lineage.upstream(lineage.find(upstream))
+    else:
+        uids = lineage.downstream(lineage.find(downstream))
+    lines = []
+    for uid in uids:
+        obj = lineage.objects.get(uid)
+        if obj is not None:
+            kind = "process" if isinstance(obj, Process) else "data"
+            lines.append(f"{kind} {qualified_name(obj)}")
+    return lines
+
+
+def build_arg_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog="what",
+        description="What, not How.  A DSL for coding a data-flow or process diagram.",
+    )
+    parser.add_argument("model_file", help=f"the model file to draw: a .what file, or a compiled {COMPILED_SUFFIX} file")
+    parser.add_argument("-o", "--output", help="the image file (default: the model file with the format's suffix)")
+    parser.add_argument("--format", default="png", help="the image format, e.g. png or svg (default: png)")
+    parser.add_argument("--no-source", action="store_true", help="don't write the Graphviz source (.gv) next to the model")
+    parser.add_argument("--groups", action="store_true", help="draw each group with processes as well, rendering in parallel")
+    parser.add_argument("--render-cache-mb", type=int, default=DEFAULT_MAX_BYTES // (1 << 20),
+                        help="the size budget of the cache of rendered images, in MB (it is kept in <cache-dir>/renders)")
+    add_cache_arguments(parser)
+    return parser
+
+
+def build_compile_arg_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog="what compile",
+        description=f"Parse a model file and save it as a compiled {COMPILED_SUFFIX} file, which loads much faster.",
+    )
+    parser.add_argument("model_file", help="the model file to compile")
+    parser.add_argument("-o", "--output", help=f"the compiled file (default: the model file with a {COMPILED_SUFFIX} suffix)")
+    add_cache_arguments(parser)
+    return parser
+
+
+def build_query_arg_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog="what query",
+        description="List everything upstream or downstream of a process or data object in the data flow.",
+    )
+    parser.add_argument("model_file", help=f"the model file to query: a .what file, or a compiled {COMPILED_SUFFIX} file")
+    direction = parser.add_mutually_exclusive_group(required=True)
+    direction.add_argument("--upstream", metavar="NAME", help="list what NAME is derived from")
+    direction.add_argument("--downstream", metavar="NAME", help="list what is affected by a change to NAME")
+    add_cache_arguments(parser)
+    return parser
+
+
+def add_cache_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--no-cache", action="store_true", help="always re-parse the model file")
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR, help="where parsed models are cached")
 
 
 def main(argv):
     if len(argv) < 2:
         print("What, not How")
         print("A DSL for coding a data-flow or process diagram.\n")
-        print("Usage:  what <model-file>\n")
+        print("Usage:  what [-o OUTPUT] [--format FORMAT] [--no-source] [--groups] [--render-cache-mb MB]")
+        print("             [--no-cache] [--cache-dir DIR] <model-file>")
+        print("        what compile [-o OUTPUT] [--no-cache] [--cache-dir DIR] <model-file>")
+        print("        what query (--upstream NAME | --downstream NAME) [--no-cache] [--cache-dir DIR] <model-file>\n")
+        sys.exit(1)
+    if argv[1] == "compile":
+        args = build_compile_arg_parser().parse_args(argv[2:])
+        cache = None if args.no_cache else ParseCache(args.cache_dir)
+        print(f"Compiled to {compile_model(args.model_file, args.output, cache)}")
+        return
+    if argv[1] == "query":
+        args = build_query_arg_parser().parse_args(argv[2:])
+        cache = None if args.no_cache else ParseCache(args.cache_dir)
+        try:
+            lines = query_model(args.model_file, args.upstream, args.downstream, cache)
+        except KeyError as e:
+            print(e.args[0])
+            sys.exit(1)
+        for line in lines:
+            print(line)
+        return
+    args = build_arg_parser().parse_args(argv[1:])
+    cache = None if args.no_cache else ParseCache(args.cache_dir)
+    render_cache = None if args.no_cache else RenderCache(os.path.join(args.cache_dir, "renders"), args.render_cache_mb << 20)
+    try:
+        generate_graph(args.model_file, cache, args.format, not args.no_source, args.output, args.groups, render_cache)
+    except RenderError as e:
+        print(e)
         sys.exit(1)
-    else:
-        model_file = argv[1]
-    generate_graph(model_file)
 
 
 if __name__ == "__main__":
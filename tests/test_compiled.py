@@ -0,0 +1,69 @@
+import pytest
+from what_not_how.compiled import CompiledModel, save_compiled, load_compiled
+from what_not_how.dsl_parser import parse_model
+from what_not_how.model_processing import post_load_processing
+
+
+model_text = """
+options:
+    title: Compiled
+    flatten: 2
+process A: Make W
+    input: X, Y?, Z*
+    output: W+
+    notes: makes W
+group Detail:
+    implements: A
+    process A1:
+        input: X
+        output: W
+"""
+
+
+def _compile(tmp_path):
+    mdl, errors = parse_model(lines=model_text.splitlines(keepends=True), reporter=None)
+    assert errors == []
+    post_load_processing(mdl)
+    mdl.data_objects["X"].notes = ["the input"]
+    fname = tmp_path / "model.whatc"
+    save_compiled(mdl, fname)
+    return mdl, fname
+
+
+def test_compiled_round_trip(tmp_path):
+    mdl, fname = _compile(tmp_path)
+    loaded = load_compiled(fname)
+
+    assert loaded.uid_count == mdl.uid_count
+    assert loaded.options.title == "Compiled" and loaded.options.flatten == 2
+    assert list(loaded.data_objects) == list(mdl.data_objects)
+    assert loaded.data_objects["X"].notes == ["the input"]
+    assert loaded.data_objects["X"].parent is loaded
+
+    process = loaded.processes["A"]
+    original = mdl.processes["A"]
+    assert (process.uid, process.desc, process.notes) == (original.uid, original.desc, ["makes W"])
+    assert process.inputs == original.inputs and process.outputs == original.outputs
+    flags = [(d.name, d.optional, d.stackable) for d in process.inputs + process.outputs]
+    assert flags == [("X", False, False), ("Y", True, False), ("Z", True, True), ("W", False, True)]
+
+    detail = loaded.groups["Detail"]
+    assert detail.parent is loaded
+    assert process.implemented_by is detail
+    assert detail.processes["A1"].inputs[0].identifier_id == loaded.data_objects["X"].uid
+
+
+def test_compiled_view(tmp_path):
+    mdl, fname = _compile(tmp_path)
+    with CompiledModel(fname) as compiled:
+        names = [compiled.string(i) for i in compiled.processes["name"].tolist()]
+        assert names == ["A", "A1"]
+        assert len(compiled.edges) == 6
+        assert compiled.string_list(compiled.data_objects["notes"][0]) == ["the input"]
+
+
+def test_compiled_rejects_other_files(tmp_path):
+    fname = tmp_path / "model.what"
+    fname.write_text(model_text)
+    with pytest.raises(ValueError):
+        CompiledModel(fname)
@@ -0,0 +1,84 @@
+from what_not_how.dsl_parser import parse_model
+from what_not_how.diagram_ir import build_diagram
+from what_not_how.diagrams import EMITTERS, register_emitter, build_data_flow_graph, diagram_source
+
+
+model_text = """
+options:
+  flatten: 1
+
+process A:
+  input: X
+  output: Y
+process B:
+  input: Y, Z?
+  output: X
+  output: W+
+group G:
+  process C:
+    input: W
+    output: V
+"""
+
+
+def _diagram():
+    mdl, _ = parse_model(lines=model_text.splitlines(keepends=True), reporter=None)
+    return mdl, build_diagram(mdl)
+
+
+def test_diagram_ir():
+    mdl, diagram = _diagram()
+    nodes = {node.label: node for node in diagram.nodes}
+    assert nodes["W"].stacked and not nodes["W"].optional
+    assert nodes["Z"].optional
+    assert nodes["C"].cluster == diagram.clusters[0].id and diagram.clusters[0].label == "G"
+    assert nodes["A"].cluster is None
+    # the cycle X -> A -> Y -> B -> X is broken at the edge back to X
+    assert [(e.tail, e.head) for e in diagram.edges if e.back] == [(nodes["B"].id, nodes["X"].id)]
+    assert len(diagram.diagnostics) == 1
+
+
+def test_every_backend_draws_the_same_diagram():
+    mdl, diagram = _diagram()
+    nodes = {node.label: node.id for node in diagram.nodes}
+    gv, d2, mermaid = (diagram_source(diagram, name) for name in ("gv", "d2", "mermaid"))
+    assert f'{nodes["A"]} [label="A"; shape=hexagon;]' in gv
+    assert "subgraph cluster_C0" in gv and "constraint=false" in gv
+    assert f'C0.{nodes["C"]}: C' in d2
+    assert f'{nodes["Z"]} -> {nodes["B"]} {{style: {{stroke-dash: 3}}}}' in d2
+    assert f'{nodes["W"]}.style.multiple: true' in d2
+    assert mermaid.startswith("graph TB\n")
+    assert f'    {nodes["A"]}{{{{"A"}}}}' in mermaid
+    assert f'    {nodes["Z"]} -.-> {nodes["B"]}' in mermaid
+    assert 'subgraph C0["G"]' in mermaid
+
+
+def test_formats_written_from_one_diagram(tmp_path):
+    mdl, _ = _diagram()
+    seen = []
+
+    @register_emitter("test-format", ".txt")
+    def emit_test(diagram):
+        seen.append(diagram)
+        yield f"{len(diagram.nodes)} nodes\n"
+
+    try:
+        base = str(tmp_path / "model")
+        build_data_flow_graph(mdl, base, formats=("gv", "mermaid", "test-format"))
+        assert (tmp_path / "model.gv").read_text() == diagram_source(build_diagram(mdl), "gv")
+        assert (tmp_path / "model.mmd").exists()
+        assert (tmp_path / "model.txt").read_text() == "8 nodes\n"
+        assert len(seen) == 1
+    finally:
+        del EMITTERS["test-format"]
+
+
+def test_group_drawn_on_its_own_labels_the_data_around_it():
+    text = "process A:\n  input: X\n  output: Y\ngroup Detail:\n  implements: A\n  process D:\n    input: X\n    output: Y\n"
+    mdl, _ = parse_model(lines=text.splitlines(keepends=True), reporter=None)
+    diagram = build_diagram(mdl.groups["Detail"])
+    labels = {node.id: node.label for node in diagram.nodes}
+    assert sorted(labels.values()) == ["D", "X", "Y"]
+    assert all(edge.tail in labels and edge.head in labels for edge in diagram.edges)
+    gv = diagram_source(diagram, "gv")
+    assert all(f'{node_id} [label=' in gv for node_id in labels)
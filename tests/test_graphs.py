@@ -0,0 +1,135 @@
+from what_not_how.dsl_parser import parse_model
+from what_not_how.diagrams import preprocess_graph_nodes
+from what_not_how.graphs import DiGraph
+from what_not_how.model_processing import post_load_processing
+
+
+model_text = """
+process A:
+    input: X
+    output: W
+group Detail:
+    process A1:
+        input: X1
+        output: W1
+process B:
+    input: W
+    output: Y, Z
+"""
+
+
+def _parse(text=model_text):
+    mdl, _ = parse_model(lines=text.splitlines(keepends=True), reporter=None)
+    return mdl
+
+
+def _names(dag, uids):
+    return sorted(dag.nodes[dag.index_of[uid]].name for uid in uids)
+
+
+def test_uids_are_dense_per_model():
+    _parse()
+    mdl = _parse()
+    uids = [p.uid for p in mdl.processes.values()] + [d.uid for d in mdl.data_objects.values()]
+    detail = mdl.groups["Detail"]
+    uids += [p.uid for p in detail.processes.values()] + [d.uid for d in detail.data_objects.values()]
+    assert sorted(uids) == list(range(mdl.uid_count))
+
+
+def test_graph_covers_only_the_listed_nodes():
+    mdl = _parse()
+    dag = DiGraph(*preprocess_graph_nodes(mdl))
+    assert len(dag.nodes) == 6
+    assert len(dag.index_of) <= mdl.uid_count
+    assert _names(dag, dag.primary_inputs()) == ["X"]
+    assert _names(dag, dag.primary_outputs()) == ["Y", "Z"]
+
+
+def test_graph_connections():
+    mdl = _parse()
+    dag = DiGraph(*preprocess_graph_nodes(mdl))
+    a, b = mdl.processes["A"].uid, mdl.processes["B"].uid
+    x, w = mdl.data_objects["X"].uid, mdl.data_objects["W"].uid
+    assert dag.is_connected(x, a)
+    assert dag.is_connected(a, w)
+    assert dag.is_connected(w, b)
+    assert not dag.is_connected(a, x)
+    assert not dag.is_connected(x, b)
+    assert dag.in_degree[dag.index_of[b]] == 1
+    assert dag.out_degree[dag.index_of[b]] == 2
+
+
+def test_initial_ranking_layers(capsys):
+    mdl = _parse()
+    dag = DiGraph(*preprocess_graph_nodes(mdl))
+    layers = dag.initial_ranking()
+    assert [_names(dag, layer) for layer in layers] == [["X"], ["A"], ["W"], ["B"], ["Y", "Z"]]
+    assert capsys.readouterr().out == ""
+
+
+def test_initial_ranking_long_chain():
+    n = 5000
+    text = "".join(f"process P{i}:\n    input: D{i}\n    output: D{i + 1}\n" for i in range(n))
+    dag = DiGraph(*preprocess_graph_nodes(_parse(text)))
+    layers = dag.initial_ranking()
+    assert len(layers) == 2 * n + 1
+    assert all(len(layer) == 1 for layer in layers)
+
+
+def test_cycles_are_ranked_and_reported():
+    text = """
+process Load:
+    input: Config
+    output: Raw
+process Fit:
+    input: Raw, Feedback
+    output: Params
+process Evaluate:
+    input: Params
+    output: Feedback, Report
+"""
+    mdl = _parse(text)
+    dag = DiGraph(*preprocess_graph_nodes(mdl))
+    layers = dag.initial_ranking()
+    assert all(node.rank is not None for node in dag.nodes)
+    assert sum(len(layer) for layer in layers) == len(dag.nodes)
+
+    cycles = dag.cycles()
+    assert len(cycles) == 1
+    assert _names(dag, cycles[0]) == ["Evaluate", "Feedback", "Fit", "Params"]
+    assert len(dag.back_edges) == 1
+    assert [d.kind for d in dag.diagnostics()] == ["cycle"]
+
+    forward_edges = [e for e in dag.edges if not e.is_back_edge]
+    assert all(e.tail.rank < e.head.rank for e in forward_edges)
+
+
+def test_self_loop_is_a_cycle():
+    dag = DiGraph(*preprocess_graph_nodes(_parse("process P:\n    input: D\n    output: D\n")))
+    dag.initial_ranking()
+    assert len(dag.cycles()) == 1
+
+
+def test_data_flow_index():
+    mdl = _parse(model_text + "process C:\n    input: W\n    output: X\n")
+    post_load_processing(mdl)
+    flow = mdl.data_flow
+    a, b, c = (mdl.processes[name] for name in "ABC")
+    detail = mdl.groups["Detail"]
+    assert flow.producers_of(mdl.data_objects["W"].uid) == [a]
+    assert flow.consumers_of(mdl.data_objects["W"].uid) == [b, c]
+    assert flow.producers_of(mdl.data_objects["X"].uid) == [c]
+    assert flow.consumers_of(detail.data_objects["X1"].uid) == [detail.processes["A1"]]
+    assert flow.producers_of(mdl.data_objects["Y"].uid) == [b]
+    assert flow.consumers_of(mdl.data_objects["Y"].uid) == []
+
+
+def test_graph_from_data_flow_index_matches_scanned_graph():
+    mdl = _parse(model_text + "process C:\n    input: W, Q\n    output: X\n")
+    post_load_processing(mdl)
+    nodes = preprocess_graph_nodes(mdl)
+    scanned, indexed = DiGraph(*nodes), DiGraph(*nodes, mdl.data_flow)
+    assert scanned.node_uids.tolist() == indexed.node_uids.tolist()
+    assert scanned.tails.tolist() == indexed.tails.tolist()
+    assert scanned.heads.tolist() == indexed.heads.tolist()
+    assert scanned.initial_ranking() == indexed.initial_ranking()
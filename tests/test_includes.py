@@ -0,0 +1,108 @@
+import os
+from what_not_how.dsl_parser import parse_model, IncludeCache
+from what_not_how.parse_cache import ParseCache, load_model
+
+
+shared_text = """
+process Measure:
+    input: Sample
+    output: Reading
+"""
+
+main_text = """
+include: shared.what
+process Report:
+    input: Reading
+    output: Summary
+group Lab:
+    import: shared.what
+    process Calibrate:
+        output: Sample
+"""
+
+
+def _write_model(tmp_path):
+    (tmp_path / "shared.what").write_text(shared_text)
+    main = tmp_path / "main.what"
+    main.write_text(main_text)
+    return str(main)
+
+
+def test_include_merges_into_group(tmp_path):
+    mdl, errors = parse_model(_write_model(tmp_path), reporter=None)
+    assert errors == []
+    assert mdl.included_files == [str(tmp_path / "shared.what")]
+
+    reading = mdl.data_objects["Reading"]
+    assert mdl.processes["Measure"].outputs[0].identifier_id == reading.uid
+    assert mdl.processes["Report"].inputs[0].identifier_id == reading.uid
+
+    # the second include is a copy of its own, resolving names visible where it is included
+    lab = mdl.groups["Lab"]
+    assert lab.processes["Measure"] is not mdl.processes["Measure"]
+    assert lab.processes["Measure"].parent is lab
+    assert lab.processes["Measure"].inputs[0].identifier_id == mdl.data_objects["Sample"].uid
+    assert lab.processes["Measure"].outputs[0].identifier_id == reading.uid
+    assert "Reading" not in lab.data_objects
+
+    uids = [p.uid for g in (mdl, lab) for p in g.processes.values()]
+    uids += [d.uid for g in (mdl, lab) for d in g.data_objects.values()]
+    assert sorted(uids) == list(range(mdl.uid_count))
+
+
+def test_included_files_parsed_once(tmp_path, monkeypatch):
+    main = _write_model(tmp_path)
+    parsed = []
+    original_parse = IncludeCache._parse
+
+    def counting_parse(self, path, session):
+        parsed.append(path)
+        return original_parse(self, path, session)
+
+    monkeypatch.setattr(IncludeCache, "_parse", counting_parse)
+    includes = IncludeCache()
+    parse_model(main, reporter=None, includes=includes)
+    parse_model(main, reporter=None, includes=includes)
+    assert len(parsed) == 1
+
+    shared = tmp_path / "shared.what"
+    shared.write_text(shared_text + "process Extra:\n    input: Reading\n")
+    os.utime(shared, ns=(0, 10**9))
+    mdl, _ = parse_model(main, reporter=None, includes=includes)
+    assert len(parsed) == 2
+    assert "Extra" in mdl.processes
+
+
+def test_include_errors(tmp_path):
+    (tmp_path / "loop.what").write_text("include: main.what\n")
+    main = tmp_path / "main.what"
+    main.write_text("include: loop.what\ninclude: missing.what\n")
+    _, errors = parse_model(str(main), reporter=None)
+    messages = [(error.fname, error.line_no, error.message) for error in errors]
+    assert messages[0] == (str(tmp_path / "loop.what"), 0, "'main.what' is included in a loop")
+    assert messages[1][:2] == (None, 1)
+    assert messages[1][2].startswith("Could not read the included file 'missing.what'")
+
+
+def test_cached_model_sees_changed_include(tmp_path):
+    main = _write_model(tmp_path)
+    cache = ParseCache(tmp_path / "cache")
+    first, _ = load_model(main, cache)
+    assert "Extra" not in first.processes
+
+    (tmp_path / "shared.what").write_text(shared_text + "process Extra:\n    input: Reading\n")
+    second, _ = load_model(main, cache)
+    assert "Extra" in second.processes
+
+
+def test_cache_tells_apart_identical_files_in_other_directories(tmp_path):
+    cache = ParseCache(tmp_path / "cache")
+    for name in ("a", "b"):
+        (tmp_path / name).mkdir()
+        (tmp_path / name / "common.what").write_text(f"process From_{name}:\n    input: X\n")
+        (tmp_path / name / "main.what").write_text("include: common.what\n")
+    a, _ = load_model(str(tmp_path / "a" / "main.what"), cache)
+    b, _ = load_model(str(tmp_path / "b" / "main.what"), cache)
+    assert list(a.processes) == ["From_a"]
+    assert list(b.processes) == ["From_b"]
+    assert b.included_files == [str(tmp_path / "b" / "common.what")]
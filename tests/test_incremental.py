@@ -0,0 +1,101 @@
+import random
+from what_not_how.dsl_parser import parse_model
+from what_not_how.incremental import IncrementalModel
+from what_not_how.model_processing import iter_groups
+from what_not_how.lineage import Lineage
+from what_not_how.diagram_ir import build_diagram
+
+
+model_text = """
+process A:
+    input: X
+    output: W
+group G:
+    process G1:
+        input: W, Q
+        output: Z
+process B:
+    input: Z, Q
+    output: X
+group H:
+    group H1:
+        process H2:
+            input: Q, W
+            output: R
+    process H3:
+        input: R
+        output: Z
+"""
+
+snippets = [
+    ["process B:\n", "    input: Q\n"],
+    ["process C:\n", "    output: Q\n"],
+    ["group G:\n", "    process G2:\n", "        input: Q, X\n"],
+    ["    process Nested:\n", "        input: W\n"],
+    ["        output: Q\n"],
+    ["process broken\n"],
+    ["# a comment\n", "\n"],
+]
+
+
+def _summary(mdl, errors):
+    """the model without its uids: every data identifier is given as the path of its data object"""
+    paths = {}
+    for group in iter_groups(mdl):
+        for data_obj in group.data_objects.values():
+            paths[data_obj.uid] = (group.name, data_obj.name)
+    summary = [(e.line_no, e.line, e.message) for e in errors]
+    for group in iter_groups(mdl):
+        summary.append(("group", group.name, group.parent.name if group.parent else None, list(group.data_objects)))
+        for process in group.processes.values():
+            summary.append(("process", process.name, process.desc, process.parent.name,
+                            [paths[d.identifier_id] for d in process.inputs + process.outputs]))
+    return summary
+
+
+def test_incremental_edits_match_full_parse():
+    rng = random.Random(7)
+    lines = model_text.splitlines(keepends=True)
+    incremental = IncrementalModel(lines)
+    assert _summary(incremental.model, incremental.errors) == _summary(*parse_model(lines=lines, reporter=None))
+
+    for _ in range(300):
+        start = rng.randrange(len(lines) + 1)
+        end = min(len(lines), start + rng.choice([0, 0, 1, 2, 4]))
+        new_lines = rng.choice(snippets) if rng.random() < 0.8 or end == start else []
+        lines[start:end] = new_lines
+        incremental.edit(start, end, new_lines)
+
+        assert incremental.lines == lines
+        expected = _summary(*parse_model(lines=lines, reporter=None))
+        assert _summary(incremental.model, incremental.errors) == expected
+        uids = [obj.uid for group in iter_groups(incremental.model)
+                for obj in list(group.data_objects.values()) + list(group.processes.values())]
+        assert len(set(uids)) == len(uids) and max(uids, default=-1) < incremental.model.uid_count
+
+
+def test_incremental_edit_reparses_only_the_edited_block(monkeypatch):
+    lines = []
+    for p in range(200):
+        lines.extend([f"process P{p}:\n", f"    input: D{p}\n", f"    output: D{p + 1}\n"])
+    incremental = IncrementalModel(lines)
+
+    parsed = []
+    original_parse_block = IncrementalModel._parse_block
+    monkeypatch.setattr(IncrementalModel, "_parse_block",
+                        lambda self, start, end: parsed.append((start, end)) or original_parse_block(self, start, end))
+    incremental.edit(301, 302, ["    input: D100, Extra\n"])
+    assert parsed == [(300, 303)]
+    process = incremental.model.processes["P100"]
+    assert [d.name for d in process.inputs] == ["D100", "Extra"]
+    assert process.inputs[0].identifier_id == incremental.model.data_objects["D100"].uid
+
+
+def test_draw_after_edit():
+    inc = IncrementalModel(model_text.splitlines(keepends=True))
+    Lineage.from_model(inc.model)
+    inc.edit(0, 0, ["process New:\n", "    input: R\n", "    output: S\n"])
+    diagram = build_diagram(inc.model)
+    assert "New" in [node.label for node in diagram.nodes]
+    lineage = Lineage.from_model(inc.model)
+    assert lineage.find("New") == inc.model.processes["New"].uid
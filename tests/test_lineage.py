@@ -0,0 +1,67 @@
+import pytest
+
+from what_not_how.dsl_parser import parse_model
+from what_not_how.lineage import Lineage
+from what_not_how.what import query_model
+
+
+model_text = """
+process A:
+    input: X
+    output: W
+process B:
+    input: W, F
+    output: Y
+    output: F
+process C:
+    input: Y
+    output: Z
+process Other:
+    input: Q
+    output: R
+group Detail:
+    process A1:
+        input: X1
+        output: Z
+"""
+
+
+def _lineage():
+    mdl, _ = parse_model(lines=model_text.splitlines(keepends=True), reporter=None)
+    return mdl, Lineage.from_model(mdl)
+
+
+def _names(lineage, uids):
+    return [lineage.objects[uid].name for uid in uids]
+
+
+def test_downstream_in_data_flow_order():
+    mdl, lineage = _lineage()
+    downstream = _names(lineage, lineage.downstream(lineage.find("X")))
+    assert sorted(downstream) == ["A", "B", "C", "F", "W", "Y", "Z"]
+    assert downstream.index("A") < downstream.index("W") < downstream.index("C") < downstream.index("Z")
+    # asking again is answered from the cached closure
+    assert _names(lineage, lineage.downstream(lineage.find("X"))) == downstream
+
+
+def test_upstream_through_cycles_and_groups():
+    mdl, lineage = _lineage()
+    assert sorted(_names(lineage, lineage.upstream(lineage.find("Z")))) == ["A", "A1", "B", "C", "F", "W", "X", "X1", "Y"]
+    # B and F form a cycle, so each is upstream of the other
+    assert "F" in _names(lineage, lineage.upstream(lineage.find("B")))
+    assert "B" in _names(lineage, lineage.upstream(lineage.find("F")))
+    assert lineage.upstream(lineage.find("X")) == []
+    assert _names(lineage, lineage.downstream(lineage.find("Detail.A1"))) == ["Z"]
+
+
+def test_find_unknown_name():
+    mdl, lineage = _lineage()
+    with pytest.raises(KeyError):
+        lineage.find("Nope")
+
+
+def test_query_command(tmp_path):
+    fname = tmp_path / "model.what"
+    fname.write_text(model_text)
+    assert query_model(str(fname), downstream="Y") == ["process C", "data Z"]
+    assert query_model(str(fname), upstream="R") == ["data Q", "process Other"]
@@ -0,0 +1,95 @@
+from what_not_how.dsl_parser import parse_model
+from what_not_how.model_data import DataObject
+from what_not_how.model_processing import post_load_processing
+
+
+model_text = """
+process A:
+    input: X, Y
+    output: W
+process B:
+    input: Y, X
+    output: V
+process C:
+    input: W
+    output: V
+process Source:
+    output: X
+process Sink:
+    input: V
+group Detail:
+    process D1:
+        input: W
+        output: Z
+    process D2:
+        input: W
+        output: Z2
+"""
+
+
+def _diagnostics(text=model_text, extra_data=()):
+    mdl, _ = parse_model(lines=text.splitlines(keepends=True), reporter=None)
+    for name in extra_data:
+        mdl.data_objects[name] = DataObject(uid=mdl.new_uid(), name=name, kind="data", parent=mdl)
+    return {(d.kind, d.message) for d in post_load_processing(mdl)}, mdl
+
+
+def test_processes_with_same_inputs_and_outputs():
+    diagnostics, mdl = _diagnostics()
+    assert ("same-inputs", "Processes A, B have the same inputs: X, Y") in diagnostics
+    assert ("same-inputs", "Processes D1, D2 in group 'Detail' have the same inputs: W") in diagnostics
+    assert ("same-outputs", "Processes B, C have the same outputs: V") in diagnostics
+    # processes in different groups are never compared
+    assert not any("C, D1" in message for _, message in diagnostics)
+    assert mdl.diagnostics
+
+
+def test_input_output_counts():
+    diagnostics, mdl = _diagnostics(extra_data=["Unused"])
+    assert ("no-inputs", "Process 'Source' has no inputs") in diagnostics
+    assert ("no-outputs", "Process 'Sink' has no outputs") in diagnostics
+    assert ("unused-data", "Data object 'Unused' is not used by any process") in diagnostics
+    assert mdl.data_objects["Unused"].uid == mdl.uid_count - 1
+    assert not any(kind == "no-inputs" and "'A'" in message for kind, message in diagnostics)
+
+
+def test_clean_model_has_no_diagnostics():
+    diagnostics, _ = _diagnostics("process A:\n    input: X\n    output: Y\nprocess B:\n    input: Y\n    output: Z\n")
+    assert diagnostics == set()
+
+
+implements_text = """
+process Top:
+    input: X
+    output: Y
+group Layer:
+    process Mid:
+        input: X
+        output: M
+    group MidDetail:
+        implements: Mid
+        process M1:
+            input: X
+            output: M
+    group TopDetail:
+        implements: Top
+        process T1:
+            input: X
+            output: Y
+group Absolute:
+    implements: .Layer.Mid
+group Missing:
+    implements: Nowhere
+"""
+
+
+def test_implements_resolves_relative_and_absolute_names():
+    mdl, _ = parse_model(lines=implements_text.splitlines(keepends=True), reporter=None)
+    diagnostics = post_load_processing(mdl)
+    layer = mdl.groups["Layer"]
+    # relative names are looked up from the group's parent outwards
+    assert mdl.processes["Top"].implemented_by is layer.groups["TopDetail"]
+    assert layer.processes["Mid"].implemented_by is layer.groups["MidDetail"]
+    messages = {(d.kind, d.message) for d in diagnostics}
+    assert ("already-implemented", "Group 'Absolute' implements process '.Layer.Mid', which is already implemented.") in messages
+    assert ("unresolved-implements", "Group 'Missing' implements process 'Nowhere', which is not defined.") in messages
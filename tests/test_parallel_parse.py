@@ -0,0 +1,70 @@
+from concurrent.futures import ThreadPoolExecutor
+from what_not_how.dsl_parser import parse_model
+from what_not_how.model_processing import iter_groups
+from what_not_how.parallel_parse import parse_model_parallel, split_into_chunks
+
+
+model_text = """
+# a comment before the first block
+process A:
+    input: X
+    output: W
+group G:
+    process G1:
+        input: W, Q
+        output: Z
+process A:
+    input: Z
+    output: X
+group H:
+    group H1:
+        process H2:
+            input: Q, W
+            output: R
+    process H3:
+        input: R
+        outputs Z
+process B:
+    input: Q
+"""
+
+
+def _summary(mdl, errors):
+    summary = [(e.line_no, e.message) for e in errors]
+    for group in iter_groups(mdl):
+        summary.append(("group", group.name, group.parent.name if group.parent else None))
+        for data_obj in group.data_objects.values():
+            summary.append(("data", group.name, data_obj.uid, data_obj.name, data_obj.kind))
+        for process in group.processes.values():
+            summary.append(("process", group.name, process.uid, process.name, process.desc,
+                            [(d.name, d.identifier_id) for d in process.inputs + process.outputs]))
+    return summary
+
+
+def test_split_into_chunks():
+    lines = model_text.splitlines(keepends=True)
+    assert split_into_chunks(lines, 100, min_chunk_lines=1) == [(0, 2), (2, 5), (5, 9), (9, 12), (12, 20), (20, 22)]
+    assert split_into_chunks(lines, 2, min_chunk_lines=1) == [(0, 12), (12, 22)]
+
+
+def test_parallel_parse_matches_sequential():
+    lines = model_text.splitlines(keepends=True)
+    expected = _summary(*parse_model(lines=lines, reporter=None))
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        for n_chunks in (2, 3, 100):
+            mdl, errors = parse_model_parallel(lines=lines, reporter=None, max_workers=n_chunks // 4 or 1,
+                                               executor=pool, min_chunk_lines=1)
+            assert _summary(mdl, errors) == expected
+            assert mdl.uid_count == len([s for s in expected if s[0] in ("data", "process")])
+
+
+def test_parallel_parse_in_processes():
+    lines = []
+    for g in range(20):
+        lines.append(f"group G{g}:\n")
+        for p in range(20):
+            lines.extend([f"    process P{p}:\n", f"        input: D{p}, Shared\n", f"        output: D{p + 1}\n"])
+        lines.extend([f"process Top{g}:\n", "    input: Shared\n", f"    output: Out{g}\n"])
+    expected = _summary(*parse_model(lines=lines, reporter=None))
+    mdl, errors = parse_model_parallel(lines=lines, reporter=None, max_workers=2, min_chunk_lines=100)
+    assert _summary(mdl, errors) == expected
@@ -1,6 +1,7 @@
 import pytest
 from what_not_how.dsl_parser import (
     smart_tokenize,
+    fast_tokenize,
     index_of_next_space,
     index_of_next_non_space,
     decode_identifier_string
@@ -11,50 +12,83 @@ def _build(inputs, expected):
     return inputs, expected
 
 
+TOKENIZE_CASES = [
+    _build("", [""]),
+    _build("   ", [""]),
+    _build("               ", [""]),
+    _build("group", ["", "group"]),
+    _build(" group A", [" ", "group", "A"]),
+    _build("  group A:", ["  ", "group", "A", ":"]),
+    _build("   group A:extra", ["   ", "group", "A", ":", "extra"]),
+    _build(
+        "group A: extra info: be aware",
+        ["", "group", "A", ":", "extra info: be aware"],
+    ),
+    _build("nas beta   :", ["", "nas beta   :"]),
+    _build("  process A:", ["  ", "process", "A", ":"]),
+    _build("inputs:", ["", "inputs", ":"]),
+    _build("input:", ["", "input", ":"]),
+    _build("  in  : ", ["  ", "in", ":"]),
+    _build("output:", ["", "output", ":"]),
+    _build("outputs:", ["", "outputs", ":"]),
+    _build("out:", ["", "out", ":"]),
+    _build("out: A, B, C", ["", "out", ":", "A", ",", "B", ",", "C"]),
+    _build("note:", ["", "note", ":"]),
+    _build("notes:", ["", "notes", ":"]),
+    _build("assumptions:", ["", "assumptions", ":"]),
+    _build("pre-conditions:", ["", "pre-conditions", ":"]),
+    _build("pre-condition:", ["", "pre-condition", ":"]),
+    _build("post-conditions:", ["", "post-conditions", ":"]),
+    _build("post-condition:", ["", "post-condition", ":"]),
+    _build("Not a list: A, B, C", ["", "Not a list: A, B, C"]),
+    _build("options:", ["", "options", ":"]),
+    _build("tool: mermaid", ["", "tool", ":", "mermaid"]),
+    _build("title: Example A", ["", "title", ":", "Example A"]),
+    _build("filename: exp-A", ["", "filename", ":", "exp-A"]),
+    _build("svg-name: output", ["", "svg-name", ":", "output"]),
+    _build("recurse: true", ["", "recurse", ":", "true"]),
+    _build("flatten: 2", ["", "flatten", ":", "2"]),
+    _build("flatten: false", ["", "flatten", ":", "false"]),
+    _build("implements: Pr-1", ["", "implements", ":", "Pr-1"]),
+]
+
+
+@pytest.mark.parametrize("input_text, expected", TOKENIZE_CASES)
+def test_smart_tokenize(input_text, expected):
+    assert smart_tokenize(input_text, 0) == expected
+
+
+@pytest.mark.parametrize("input_text, expected", TOKENIZE_CASES)
+def test_fast_tokenize(input_text, expected):
+    assert fast_tokenize(input_text, 0) == expected
+
+
 @pytest.mark.parametrize(
-    "input_text, expected",
+    "input_text",
     [
-        _build("", [""]),
-        _build("   ", [""]),
-        _build("               ", [""]),
-        _build("group", ["", "group"]),
-        _build(" group A", [" ", "group", "A"]),
-        _build("  group A:", ["  ", "group", "A", ":"]),
-        _build("   group A:extra", ["   ", "group", "A", ":", "extra"]),
-        _build(
-            "group A: extra info: be aware",
-            ["", "group", "A", ":", "extra info: be aware"],
-        ),
-        _build("nas beta   :", ["", "nas beta   :"]),
-        _build("  process A:", ["  ", "process", "A", ":"]),
-        _build("inputs:", ["", "inputs", ":"]),
-        _build("input:", ["", "input", ":"]),
-        _build("  in  : ", ["  ", "in", ":"]),
-        _build("output:", ["", "output", ":"]),
-        _build("outputs:", ["", "outputs", ":"]),
-        _build("out:", ["", "out", ":"]),
-        _build("out: A, B, C", ["", "out", ":", "A", ",", "B", ",", "C"]),
-        _build("note:", ["", "note", ":"]),
-        _build("notes:", ["", "notes", ":"]),
-        _build("assumptions:", ["", "assumptions", ":"]),
-        _build("pre-conditions:", ["", "pre-conditions", ":"]),
-        _build("pre-condition:", ["", "pre-condition", ":"]),
-        _build("post-conditions:", ["", "post-conditions", ":"]),
-        _build("post-condition:", ["", "post-condition", ":"]),
-        _build("Not a list: A, B, C", ["", "Not a list: A, B, C"]),
-        _build("options:", ["", "options", ":"]),
-        _build("tool: mermaid", ["", "tool", ":", "mermaid"]),
-        _build("title: Example A", ["", "title", ":", "Example A"]),
-        _build("filename: exp-A", ["", "filename", ":", "exp-A"]),
-        _build("svg-name: output", ["", "svg-name", ":", "output"]),
-        _build("recurse: true", ["", "recurse", ":", "true"]),
-        _build("flatten: 2", ["", "flatten", ":", "2"]),
-        _build("flatten: false", ["", "flatten", ":", "false"]),
-        _build("implements: Pr-1", ["", "implements", ":", "Pr-1"]),
+        "# a comment",
+        "  # an indented comment",
+        "\tgroup A:",
+        "  \t  ",
+        "Group A::extra",
+        "process A B C D",
+        "process",
+        "    in: A, B ,C,,D",
+        "    in: A (Some Desc), B+",
+        "    in",
+        "    notes foo bar",
+        "    notes:: foo",
+        "    notes",
+        "    options: extra",
+        "    tool:",
+        "    tool mermaid",
+        "    stackable:  true  ",
+        ": leading colon",
+        ", leading comma",
     ],
 )
-def test_smart_tokenize(input_text, expected):
-    assert smart_tokenize(input_text, 0) == expected
+def test_fast_tokenize_matches_smart_tokenize(input_text):
+    assert fast_tokenize(input_text, 0) == smart_tokenize(input_text, 0)
 
 
 @pytest.mark.parametrize(
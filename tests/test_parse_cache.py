@@ -0,0 +1,67 @@
+import os
+from what_not_how import parse_cache
+from what_not_how.disk_cache import DiskCache
+from what_not_how.parse_cache import ParseCache, load_model
+
+
+model_text = """
+process A:
+    input: X
+    output: W
+process B:
+    input: W
+    output: Z
+"""
+
+
+def test_load_model_uses_cache(tmp_path, monkeypatch):
+    model_file = tmp_path / "model.what"
+    model_file.write_text(model_text)
+    cache = ParseCache(tmp_path / "cache")
+
+    first, _ = load_model(str(model_file), cache)
+
+    def fail_parse(*_args, **_kwargs):
+        raise AssertionError("the cached model should have been used")
+
+    monkeypatch.setattr(parse_cache, "parse_model", fail_parse)
+    second, _ = load_model(str(model_file), cache)
+    assert list(second.processes) == list(first.processes)
+    assert second.processes["B"].parent is second
+
+
+def test_load_model_reparses_changed_file(tmp_path):
+    model_file = tmp_path / "model.what"
+    model_file.write_text(model_text)
+    cache = ParseCache(tmp_path / "cache")
+    load_model(str(model_file), cache)
+
+    model_file.write_text(model_text + "process C:\n    input: Z\n")
+    mdl, _ = load_model(str(model_file), cache)
+    assert list(mdl.processes) == ["A", "B", "C"]
+
+
+def test_disk_cache_evicts_least_recently_used(tmp_path):
+    cache = DiskCache(tmp_path, max_bytes=350)
+    for i, key in enumerate(["a", "b", "c"]):
+        cache.put(key, b"x" * 100)
+        os.utime(cache.path_for(key), (i, i))
+
+    # reading 'a' makes 'b' the least recently used entry
+    assert cache.get("a") == b"x" * 100
+    cache.put("d", b"x" * 100)
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+    assert cache.get("d") is not None
+
+
+def test_other_cache_format_is_a_miss(tmp_path, monkeypatch):
+    model_file = tmp_path / "model.what"
+    model_file.write_text(model_text)
+    cache = ParseCache(tmp_path / "cache")
+    load_model(str(model_file), cache)
+    key = ParseCache.key_for(str(model_file))
+
+    monkeypatch.setattr(parse_cache, "CACHE_FORMAT", parse_cache.CACHE_FORMAT + 1)
+    assert ParseCache.key_for(str(model_file)) != key
+    assert cache.get(ParseCache.key_for(str(model_file))) is None
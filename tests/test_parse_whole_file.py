@@ -1,6 +1,11 @@
 # import pytest
+import io
+from concurrent.futures import ThreadPoolExecutor
 from typing import List
+import pytest
+from pydantic import ValidationError
 from what_not_how.dsl_parser import parse_model
+from what_not_how.model_data import validate_model
 
 
 input_file = """
@@ -40,3 +45,92 @@ def test_parse_file():
     line_list = __generate_input_lines()
     mdl, err_list = parse_model(lines=line_list)
     print("asefaseF")
+
+
+def test_parse_file_fast_lexer():
+    classic, _ = parse_model(lines=__generate_input_lines())
+    fast, _ = parse_model(lines=__generate_input_lines(), lexer="fast")
+    assert list(fast.processes) == list(classic.processes)
+    assert list(fast.data_objects) == list(classic.data_objects)
+    for name, proc in classic.processes.items():
+        assert [d.name for d in fast.processes[name].inputs] == [d.name for d in proc.inputs]
+        assert [d.name for d in fast.processes[name].outputs] == [d.name for d in proc.outputs]
+
+
+def test_parse_streamed_lines():
+    from_list, _ = parse_model(lines=__generate_input_lines())
+    from_generator, _ = parse_model(lines=(line for line in __generate_input_lines()))
+    from_stream, _ = parse_model(lines=io.StringIO(input_file))
+    for mdl in (from_generator, from_stream):
+        assert list(mdl.processes) == list(from_list.processes)
+        assert list(mdl.data_objects) == list(from_list.data_objects)
+        outputs = [d.name for d in mdl.processes["B"].outputs]
+        assert outputs == [d.name for d in from_list.processes["B"].outputs]
+
+
+def test_parse_deeply_nested_groups():
+    depth = 3000
+    lines = [" " * i + f"group G{i}:\n" for i in range(depth)]
+    lines.append(" " * depth + "process P:\n")
+    lines.append(" " * (depth + 1) + "input: X\n")
+    mdl, _ = parse_model(lines=lines)
+    group = mdl
+    for i in range(depth):
+        group = group.groups[f"G{i}"]
+    assert [d.name for d in group.processes["P"].inputs] == ["X"]
+
+
+def test_parse_sessions_are_independent():
+    bad_lines = ["process A:\n", "    input X\n", "    stackable: maybe\n"]
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        results = list(pool.map(
+            lambda lines: parse_model(lines=lines, reporter=None),
+            [__generate_input_lines(), bad_lines] * 4,
+        ))
+    good_errors = [len(errors) for _, errors in results[0::2]]
+    bad_errors = [len(errors) for _, errors in results[1::2]]
+    assert len(set(good_errors)) == 1
+    assert bad_errors == [2, 2, 2, 2]
+    for mdl, _ in results:
+        uids = [p.uid for p in mdl.processes.values()] + [d.uid for d in mdl.data_objects.values()]
+        assert sorted(uids) == list(range(len(uids)))
+
+
+def test_nested_references_resolve_to_ancestor_objects():
+    lines = [
+        "process Top:\n",
+        "    output: X\n",
+        "group Outer:\n",
+        "    process Middle:\n",
+        "        input: X\n",
+        "        output: Y\n",
+        "    group Inner:\n",
+        "        process Bottom:\n",
+        "            input: X, Y\n",
+        "group Sibling:\n",
+        "    process Other:\n",
+        "        input: Y\n",
+    ]
+    mdl, errors = parse_model(lines=lines, reporter=None)
+    assert errors == []
+    outer = mdl.groups["Outer"]
+    bottom = outer.groups["Inner"].processes["Bottom"]
+    x = mdl.data_objects["X"]
+    assert mdl.processes["Top"].outputs[0].identifier_id == x.uid
+    assert outer.processes["Middle"].inputs[0].identifier_id == x.uid
+    assert bottom.inputs[0].identifier_id == x.uid
+    assert bottom.inputs[1].identifier_id == outer.data_objects["Y"].uid
+    assert "X" not in outer.data_objects and "X" not in outer.groups["Inner"].data_objects
+    # Y is local to Outer, so the sibling group gets its own
+    sibling = mdl.groups["Sibling"]
+    other_y = sibling.data_objects["Y"]
+    assert sibling.processes["Other"].inputs[0].identifier_id == other_y.uid != outer.data_objects["Y"].uid
+    assert other_y.parent is sibling
+
+
+def test_parse_then_validate():
+    mdl, errors = parse_model(lines=__generate_input_lines(), reporter=None, validate=True)
+    process = next(iter(mdl.processes.values()))
+    process.inputs[0].identifier_id = "not a uid"
+    with pytest.raises(ValidationError):
+        validate_model(mdl)
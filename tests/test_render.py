@@ -0,0 +1,59 @@
+import asyncio
+import sys
+
+import pytest
+
+from what_not_how.render import RENDERERS, Renderer, RenderError, RenderJob, render_image, render_all, render_many
+from what_not_how.what import generate_graph
+
+
+# a stand-in for a diagram tool: reads the source from stdin and writes "<format>:<source>" to stdout
+ECHO = "import sys; sys.stdout.write(sys.argv[1] + ':' + sys.stdin.read())"
+FAIL = "import sys; sys.stderr.write('syntax error'); sys.exit(2)"
+
+
+@pytest.fixture
+def echo_dot(monkeypatch):
+    monkeypatch.setitem(RENDERERS, "dot", Renderer("dot", "gv", lambda fmt: [sys.executable, "-c", ECHO, fmt]))
+
+
+def test_render_through_stdin_and_stdout(echo_dot):
+    assert render_image("digraph G {}\n", "dot", "svg") == b"svg:digraph G {}\n"
+
+
+def test_render_errors(monkeypatch):
+    monkeypatch.setitem(RENDERERS, "failing", Renderer("failing", "gv", lambda fmt: [sys.executable, "-c", FAIL]))
+    monkeypatch.setitem(RENDERERS, "missing", Renderer("missing", "gv", lambda fmt: ["no-such-renderer-here"]))
+    with pytest.raises(RenderError) as error:
+        render_image("", "failing")
+    assert error.value.returncode == 2 and error.value.stderr == "syntax error"
+    with pytest.raises(RenderError):
+        render_image("", "missing")
+
+
+def test_generate_graph_writes_only_the_image(tmp_path, echo_dot):
+    fname = tmp_path / "model.what"
+    fname.write_text("process A:\n    input: X\n    output: Y\n")
+    assert generate_graph(str(fname), fmt="svg", write_source=False) == [str(tmp_path / "model.svg")]
+    assert (tmp_path / "model.svg").read_bytes().startswith(b"svg:digraph G {\n")
+    assert not (tmp_path / "model.gv").exists()
+
+
+def test_render_many_collects_every_result(monkeypatch, echo_dot):
+    monkeypatch.setitem(RENDERERS, "failing", Renderer("failing", "gv", lambda fmt: [sys.executable, "-c", FAIL]))
+    jobs = [RenderJob(f"graph {i}", "dot", "png", f"job {i}") for i in range(5)]
+    jobs.insert(2, RenderJob("broken", "failing", "png", "broken"))
+    results = render_many(jobs, max_concurrency=2)
+    assert [result.job.name for result in results] == [job.name for job in jobs]
+    assert [result.image for result in results if result.ok] == [f"png:graph {i}".encode() for i in range(5)]
+    assert [(result.returncode, result.stderr) for result in results if not result.ok] == [(2, "syntax error")]
+    # the same from a running event loop
+    assert asyncio.run(render_all(jobs[:2]))[1].image == b"png:graph 1"
+
+
+def test_generate_graph_of_each_group(tmp_path, echo_dot):
+    fname = tmp_path / "model.what"
+    fname.write_text("process A:\n    input: X\n    output: Y\ngroup G:\n    process B:\n        input: Y\n        output: Z\n")
+    written = generate_graph(str(fname), write_source=False, groups=True)
+    assert written == [str(tmp_path / "model.png"), str(tmp_path / "model_G.png")]
+    assert b'label="B"' in (tmp_path / "model_G.png").read_bytes()
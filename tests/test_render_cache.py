@@ -0,0 +1,105 @@
+import os
+import subprocess
+import sys
+import threading
+
+import pytest
+
+from what_not_how import diagrams
+from what_not_how.render import RENDERERS, Renderer, RenderJob
+from what_not_how.render_cache import RenderCache, render_many_cached
+from what_not_how.what import generate_graph
+
+
+# a stand-in for a diagram tool that counts its runs in the file named by its first argument
+COUNTING = (
+    "import sys; open(sys.argv[1], 'a').write('x'); "
+    "sys.stdout.write(sys.argv[2] + ':' + sys.stdin.read())"
+)
+
+model_text = """
+process A:
+    input: X, S?
+    output: Y+
+process B:
+    input: Y, S?
+    output: Z+, X
+group G:
+    process C:
+        input: Z
+        output: W
+"""
+
+
+@pytest.fixture
+def runs(tmp_path, monkeypatch):
+    counter = tmp_path / "runs"
+    counter.write_text("")
+
+    def command(fmt):
+        return [sys.executable, "-c", COUNTING, str(counter), fmt]
+
+    monkeypatch.setitem(RENDERERS, "dot", Renderer("dot", "gv", command))
+    return lambda: len(counter.read_text())
+
+
+def test_unchanged_diagrams_are_not_rendered_again(tmp_path, runs):
+    fname = tmp_path / "model.what"
+    fname.write_text(model_text)
+    cache = RenderCache(tmp_path / "renders")
+    generate_graph(str(fname), write_source=False, groups=True, render_cache=cache)
+    first = (tmp_path / "model.png").read_bytes()
+    assert runs() == 2
+    (tmp_path / "model.png").unlink()
+    generate_graph(str(fname), write_source=False, groups=True, render_cache=cache)
+    assert runs() == 2
+    assert (tmp_path / "model.png").read_bytes() == first
+    generate_graph(str(fname), fmt="svg", write_source=False, render_cache=cache)
+    assert runs() == 3
+
+
+def test_render_many_cached(tmp_path, runs):
+    cache = RenderCache(tmp_path / "renders")
+    jobs = [RenderJob("a", "dot", "png"), RenderJob("b", "dot", "png")]
+    assert [r.image for r in render_many_cached(jobs[:1], cache)] == [b"png:a"]
+    assert [r.image for r in render_many_cached(jobs, cache)] == [b"png:a", b"png:b"]
+    assert runs() == 2
+    assert RenderCache.key_for(jobs[0]) != RenderCache.key_for(RenderJob("a", "dot", "svg"))
+
+
+def test_cache_io_runs_off_the_event_loop(tmp_path, runs, monkeypatch):
+    cache = RenderCache(tmp_path / "renders")
+    threads = []
+    for name in ("get", "put"):
+        method = getattr(cache, name)
+
+        def recording(*args, method=method):
+            threads.append(threading.current_thread())
+            return method(*args)
+
+        monkeypatch.setattr(cache, name, recording)
+    render_many_cached([RenderJob("a", "dot", "png")], cache)
+    assert len(threads) == 2 and threading.main_thread() not in threads
+
+
+def test_emitted_source_does_not_depend_on_hash_seed(tmp_path):
+    fname = tmp_path / "model.what"
+    fname.write_text(model_text)
+    script = (
+        "import sys\n"
+        "from what_not_how.dsl_parser import parse_model\n"
+        "from what_not_how.diagram_ir import build_diagram\n"
+        "from what_not_how.diagrams import diagram_source\n"
+        "mdl, _ = parse_model(sys.argv[1], reporter=None)\n"
+        "diagram = build_diagram(mdl)\n"
+        "sys.stdout.write(''.join(diagram_source(diagram, fmt) for fmt in ('gv', 'd2', 'mermaid')))\n"
+    )
+    # the package is found through pytest's pythonpath, which the subprocess doesn't get
+    package_dir = os.path.dirname(os.path.dirname(diagrams.__file__))
+    python_path = os.pathsep.join(filter(None, [package_dir, os.environ.get("PYTHONPATH")]))
+    sources = set()
+    for seed in ("1", "2", "3"):
+        env = dict(os.environ, PYTHONHASHSEED=seed, PYTHONPATH=python_path)
+        result = subprocess.run([sys.executable, "-c", script, str(fname)], env=env, capture_output=True, check=True)
+        sources.add(result.stdout)
+    assert len(sources) == 1